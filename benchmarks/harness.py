@@ -0,0 +1,180 @@
+"""Small benchmark harness with json results that can be compared between runs"""
+
+import argparse
+import gc
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+# A case returns the function to measure, so setup is not measured
+Case = Callable[[], Callable[[], Any]]
+
+
+class Result(NamedTuple):
+    calls: int
+    ops_per_sec: float
+    mean_us: float
+    p50_us: float
+    p90_us: float
+    p99_us: float
+    alloc_peak_bytes: int
+    alloc_retained_bytes: float
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(fraction * len(ordered)))
+    return ordered[index]
+
+
+def _calibrate(func: Callable, sample_time: float) -> int:
+    """Number of calls that take at least `sample_time` seconds"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        if time.perf_counter() - start >= sample_time or number >= 1 << 20:
+            return number
+        number *= 2
+
+
+def _allocations(func: Callable, calls: int):
+    """Median peak of allocated bytes during a call and bytes kept per call"""
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(calls):
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - current)
+
+        # Separate loop, so the recorded peaks are not counted as kept memory
+        before, _ = tracemalloc.get_traced_memory()
+        for _ in range(calls):
+            func()
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return int(statistics.median(peaks)), (after - before) / calls
+
+
+def measure(
+    func: Callable,
+    min_time: float = 0.5,
+    samples: int = 50,
+    alloc_calls: int = 100,
+) -> Result:
+    """Time batches of calls and report per call latencies.
+
+    Calls are grouped so that one sample takes about `min_time / samples` seconds,
+    which keeps the overhead of the timer out of fast operations.
+    """
+    func()
+    number = _calibrate(func, min_time / samples)
+
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        timings = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            timings.append((time.perf_counter() - start) / number)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    peak, retained = _allocations(func, alloc_calls)
+    mean = statistics.fmean(timings)
+    return Result(
+        calls=number * samples,
+        ops_per_sec=1 / mean,
+        mean_us=mean * 1e6,
+        p50_us=percentile(timings, 0.5) * 1e6,
+        p90_us=percentile(timings, 0.9) * 1e6,
+        p99_us=percentile(timings, 0.99) * 1e6,
+        alloc_peak_bytes=peak,
+        alloc_retained_bytes=retained,
+    )
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def compare(
+    results: Dict[str, Dict[str, Any]],
+    baseline: Dict[str, Dict[str, Any]],
+    threshold: float,
+) -> List[str]:
+    """Print the change in throughput, returns the names of regressed cases"""
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        change = result["ops_per_sec"] / old["ops_per_sec"] - 1
+        flag = ""
+        if change < -threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<28} {change:+8.1%}{flag}")
+    return regressions
+
+
+def run(cases: Dict[str, Case], description: str, argv: Optional[List[str]] = None):
+    """Command line entry point of a benchmark module"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--output", help="write the results as json to this file")
+    parser.add_argument("--compare", help="json results of an earlier run")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="slowdown that counts as a regression (default: 0.1)",
+    )
+    parser.add_argument("--filter", default="", help="only run matching cases")
+    parser.add_argument("--min-time", type=float, default=0.5)
+    parser.add_argument("--samples", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    print(
+        f"{'case':<28} {'ops/sec':>12} {'p50 us':>10} {'p99 us':>10}"
+        f" {'peak B':>9} {'kept B':>8}"
+    )
+    results = {}
+    for name, case in cases.items():
+        if args.filter not in name:
+            continue
+        result = measure(case(), args.min_time, args.samples)
+        results[name] = result._asdict()
+        print(
+            f"{name:<28} {result.ops_per_sec:>12,.0f} {result.p50_us:>10.2f}"
+            f" {result.p99_us:>10.2f} {result.alloc_peak_bytes:>9}"
+            f" {result.alloc_retained_bytes:>8.1f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"environment": environment(), "results": results}, output)
+
+    if args.compare:
+        with open(args.compare, "r") as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+        print()
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
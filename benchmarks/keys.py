@@ -0,0 +1,83 @@
+"""Benchmarks of the mnemonic codec and key derivation.
+
+Run from the repository root:
+
+    python -m benchmarks.keys --output keys.json
+    python -m benchmarks.keys --compare keys.json
+"""
+
+import random
+from typing import Dict
+
+from pysession.cryptography.mnemonic import SEEDSIZE, KeyPair, Language
+
+from .harness import Case, run
+
+# Fixed seed so every run measures the same inputs
+SEED = random.Random(0).getrandbits(SEEDSIZE * 8).to_bytes(SEEDSIZE, "little")
+WORDS = KeyPair.from_seed(SEED).get_mnemonic()
+
+
+def language_load():
+    return lambda: Language.from_file("english")
+
+
+def keypair_init():
+    return lambda: KeyPair()
+
+
+def verify_mnemonic():
+    pair = KeyPair()
+    words = WORDS.split(" ")
+
+    def verify():
+        pair.words = words
+        pair._verify_mnemonic()
+
+    return verify
+
+
+def decode_mnemonic():
+    pair = KeyPair()
+    pair.load_words(WORDS.split(" "))
+    return pair._decode_mnemonic
+
+
+def encode_mnemonic():
+    pair = KeyPair.from_seed(SEED)
+    return pair._encode_mnemonic
+
+
+def generate_keys(version: int):
+    def case():
+        pair = KeyPair.from_seed(SEED, version=version)
+        if version == 3:
+            return pair._generate_v3_keys
+        return pair._generate_v2_keys
+
+    return case
+
+
+def from_words():
+    return lambda: KeyPair.from_words(WORDS).get_public_key()
+
+
+def new_keys():
+    return lambda: KeyPair.new_keys().get_public_key()
+
+
+CASES: Dict[str, Case] = {
+    "language_load": language_load,
+    "keypair_init": keypair_init,
+    "verify_mnemonic": verify_mnemonic,
+    "decode_mnemonic": decode_mnemonic,
+    "encode_mnemonic": encode_mnemonic,
+    "generate_v2_keys": generate_keys(2),
+    "generate_v3_keys": generate_keys(3),
+    "from_words": from_words,
+    "new_keys": new_keys,
+}
+
+
+if __name__ == "__main__":
+    run(CASES, "Benchmarks of the mnemonic codec and key derivation")
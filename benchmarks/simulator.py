@@ -0,0 +1,278 @@
+"""Simulated network of storage nodes on localhost.
+
+Every node listens on its own port with a self signed certificate, like real
+storage servers, and a plain http seed serves the node list. Nodes answer the
+calls `Swarm` makes: `get_n_service_nodes` on the seed and `oxend_request`,
+`get_snodes_for_pubkey`, `store`, `retrieve` and `info` on `/storage_rpc/v1`,
+including jsonrpc batches. Latency, injected errors and swarm reorganisations
+are configurable.
+"""
+
+import asyncio
+import hashlib
+import math
+import os
+import random
+import socket
+import ssl
+import subprocess
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from aiohttp import web
+
+# Returns the delay of a single response in seconds
+Latency = Callable[[], float]
+
+
+def no_latency() -> float:
+    return 0.0
+
+
+def lognormal(median: float, sigma: float = 0.5, seed: Optional[int] = None) -> Latency:
+    """Latency with a long tail, like requests over the internet"""
+    if median <= 0:
+        return no_latency
+    rng = random.Random(seed)
+    mu = math.log(median)
+    return lambda: rng.lognormvariate(mu, sigma)
+
+
+def self_signed_context() -> ssl.SSLContext:
+    """Server context with a throwaway certificate created by openssl"""
+    with tempfile.TemporaryDirectory() as directory:
+        key = os.path.join(directory, "key.pem")
+        cert = os.path.join(directory, "cert.pem")
+        subprocess.run(
+            [
+                "openssl",
+                "req",
+                "-x509",
+                "-newkey",
+                "ec",
+                "-pkeyopt",
+                "ec_paramgen_curve:prime256v1",
+                "-nodes",
+                "-days",
+                "1",
+                "-subj",
+                "/CN=localhost",
+                "-keyout",
+                key,
+                "-out",
+                cert,
+            ],
+            check=True,
+            capture_output=True,
+        )
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(cert, key)
+    return context
+
+
+class SimulatedNode:
+    def __init__(self, index: int, swarm_id: int, rng: random.Random):
+        self.index = index
+        self.swarm_id = swarm_id
+        self.port = 0
+        self.pubkey_ed25519 = "%064x" % rng.getrandbits(256)
+        self.pubkey_x25519 = "%064x" % rng.getrandbits(256)
+
+    def state(self, host: str) -> Dict[str, Any]:
+        """Entry of the oxend service node list"""
+        return {
+            "public_ip": host,
+            "storage_port": self.port,
+            "pubkey_ed25519": self.pubkey_ed25519,
+            "pubkey_x25519": self.pubkey_x25519,
+            "swarm_id": self.swarm_id,
+        }
+
+    def snode(self, host: str) -> Dict[str, Any]:
+        """Entry of a swarm as returned by a storage server"""
+        return {
+            "ip": host,
+            "port": self.port,
+            "pubkey_ed25519": self.pubkey_ed25519,
+            "pubkey_x25519": self.pubkey_x25519,
+        }
+
+
+class Network:
+    """Storage nodes in swarms of `swarm_size`, with accounts spread over swarms.
+
+    Every `reorg_interval` seconds accounts move to another swarm, after which the
+    old swarm answers requests for them with the new swarm (`snodes`).
+    """
+
+    def __init__(
+        self,
+        node_count: int = 30,
+        swarm_size: int = 5,
+        latency: Latency = no_latency,
+        error_rate: float = 0.0,
+        reorg_interval: Optional[float] = None,
+        seed: Optional[int] = None,
+        host: str = "127.0.0.1",
+    ):
+        self.host = host
+        self.latency = latency
+        self.error_rate = error_rate
+        self.reorg_interval = reorg_interval
+        self.rng = random.Random(seed)
+
+        self.nodes = [
+            SimulatedNode(index, index // swarm_size, self.rng)
+            for index in range(node_count)
+        ]
+        self.swarm_count = -(-node_count // swarm_size)
+        self.by_port: Dict[int, SimulatedNode] = {}
+        self.block_hash = "%064x" % self.rng.getrandbits(256)
+        self.offset = 0
+        self.messages: Dict[str, List[Dict[str, Any]]] = {}
+
+        self.requests: Dict[str, int] = {}
+        self.errors = 0
+        self.redirects = 0
+
+        self.seed_url = ""
+        self._runner: Optional[web.AppRunner] = None
+        self._reorganiser: Optional[asyncio.Task] = None
+
+    def swarm_id(self, public_key: str) -> int:
+        return (int(public_key[2:18], 16) + self.offset) % self.swarm_count
+
+    def swarm_of(self, public_key: str) -> List[SimulatedNode]:
+        swarm_id = self.swarm_id(public_key)
+        return [node for node in self.nodes if node.swarm_id == swarm_id]
+
+    def reorganise(self):
+        """Move every account to the next swarm and start a new block"""
+        self.offset += 1
+        self.block_hash = "%064x" % self.rng.getrandbits(256)
+
+    def configure(self, swarm):
+        """Point a `Swarm` at the seed of this network"""
+        swarm.seed_node_list = [{"url": self.seed_url}]
+        swarm.storage_server_seed_cache = []
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/json_rpc", self._seed)
+        app.router.add_post("/storage_rpc/v1", self._storage)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+
+        context = self_signed_context()
+        for node in self.nodes:
+            sock = self._listen()
+            node.port = sock.getsockname()[1]
+            self.by_port[node.port] = node
+            await web.SockSite(self._runner, sock, ssl_context=context).start()
+
+        sock = self._listen()
+        await web.SockSite(self._runner, sock).start()
+        self.seed_url = f"http://{self.host}:{sock.getsockname()[1]}/json_rpc"
+
+        if self.reorg_interval:
+            self._reorganiser = asyncio.ensure_future(self._reorganise())
+
+    def _listen(self) -> socket.socket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, 0))
+        return sock
+
+    async def _reorganise(self):
+        while True:
+            await asyncio.sleep(self.reorg_interval)
+            self.reorganise()
+
+    async def close(self):
+        if self._reorganiser is not None:
+            self._reorganiser.cancel()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def __aenter__(self) -> "Network":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _seed(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        limit = body.get("params", {}).get("limit") or len(self.nodes)
+        nodes = self.rng.sample(self.nodes, min(limit, len(self.nodes)))
+        states = [node.state(self.host) for node in nodes]
+        return web.json_response({"result": {"service_node_states": states}})
+
+    async def _storage(self, request: web.Request) -> web.Response:
+        node = self.by_port[request.transport.get_extra_info("sockname")[1]]
+        body = await request.json()
+
+        delay = self.latency()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=503)
+
+        if isinstance(body, list):
+            return web.json_response(
+                [{"id": call.get("id"), **self._call(node, call)} for call in body]
+            )
+        return web.json_response(self._call(node, body))
+
+    def _call(self, node: SimulatedNode, call: Dict[str, Any]) -> Dict[str, Any]:
+        method = call.get("method", "")
+        params = call.get("params", {})
+        self.requests[method] = self.requests.get(method, 0) + 1
+
+        if method == "oxend_request":
+            return {"result": self._service_nodes(params.get("params", {}))}
+        if method == "info":
+            return {"version": [2, 0, 0], "timestamp": int(time.time() * 1000)}
+
+        public_key = params.get("pubKey", "")
+        swarm = self.swarm_of(public_key)
+        snodes = {"snodes": [snode.snode(self.host) for snode in swarm]}
+        if method == "get_snodes_for_pubkey":
+            return snodes
+        if method not in ("store", "retrieve"):
+            return {"error": {"code": -32601, "message": f"Unknown method {method}"}}
+
+        if node not in swarm:
+            self.redirects += 1
+            return snodes
+        if method == "store":
+            return self._store(public_key, params)
+        return self._retrieve(public_key, params.get("lastHash", ""))
+
+    def _service_nodes(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        if params.get("poll_block_hash") == self.block_hash:
+            return {"unchanged": True, "block_hash": self.block_hash}
+        return {
+            "service_node_states": [node.state(self.host) for node in self.nodes],
+            "block_hash": self.block_hash,
+        }
+
+    def _store(self, public_key: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        data = params.get("data", "")
+        message_hash = hashlib.blake2b(
+            f"{public_key}{params.get('timestamp')}{data}".encode(), digest_size=32
+        ).hexdigest()
+        expiration = int(params.get("timestamp", 0)) + int(params.get("ttl", 0))
+        self.messages.setdefault(public_key, []).append(
+            {"hash": message_hash, "expiration": expiration, "data": data}
+        )
+        return {"hash": message_hash}
+
+    def _retrieve(self, public_key: str, last_hash: str) -> Dict[str, Any]:
+        messages = self.messages.get(public_key, [])
+        for index, message in enumerate(messages):
+            if message["hash"] == last_hash:
+                return {"messages": messages[index + 1 :]}
+        return {"messages": messages}
@@ -0,0 +1,181 @@
+"""Load test of `Swarm` against the simulated storage node network.
+
+Run from the repository root, for example:
+
+    python -m benchmarks.swarm_load --operation retrieve --concurrency 64
+    python -m benchmarks.swarm_load --latency 0.02 --error-rate 0.01 \\
+        --reorg-interval 2 --output load.json
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Any, Dict, List
+
+from pysession.metrics import metrics
+from pysession.networking.swarm import Swarm
+from pysession.networking.util import close_client
+
+from .harness import environment, percentile
+from .simulator import Network, lognormal
+
+OPERATIONS = ("lookup", "cached", "retrieve", "store")
+
+
+async def operation(swarm: Swarm, name: str, public_key: str):
+    if name == "lookup":
+        # Always ask the network, bypassing the cache
+        swarm.swarm_map.pop(public_key)
+        return await swarm.lookup_swarm(public_key)
+    if name == "cached":
+        return await swarm.get_swarm_node_url(public_key)
+
+    url = await swarm.get_swarm_node_url(public_key)
+    if name == "retrieve":
+        return await swarm.ask_public_key(url, "retrieve", public_key, {"lastHash": ""})
+    params = {
+        "data": "bG9hZA==",
+        "ttl": "60000",
+        "timestamp": str(int(time.time() * 1000)),
+    }
+    return await swarm.ask_public_key(url, "store", public_key, params)
+
+
+async def drive(
+    swarm: Swarm, name: str, accounts: List[str], requests: int, concurrency: int
+) -> Dict[str, Any]:
+    """Run `requests` operations with `concurrency` workers and time every one"""
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            public_key = random.choice(accounts)
+            start = time.perf_counter()
+            try:
+                await operation(swarm, name, public_key)
+            except Exception as e:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    result: Dict[str, Any] = {
+        "operation": name,
+        "requests": requests,
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "throughput": len(latencies) / elapsed,
+        "errors": errors,
+    }
+    if latencies:
+        result.update(
+            p50_ms=percentile(latencies, 0.5) * 1e3,
+            p90_ms=percentile(latencies, 0.9) * 1e3,
+            p99_ms=percentile(latencies, 0.99) * 1e3,
+            max_ms=max(latencies) * 1e3,
+        )
+    return result
+
+
+async def main(args) -> Dict[str, Any]:
+    random.seed(args.seed)
+    accounts = ["05%064x" % random.getrandbits(256) for _ in range(args.accounts)]
+    latency = lognormal(args.latency, args.latency_sigma, seed=args.seed)
+
+    metrics.reset()
+    metrics.enable()
+    network = Network(
+        node_count=args.nodes,
+        swarm_size=args.swarm_size,
+        latency=latency,
+        error_rate=args.error_rate,
+        reorg_interval=args.reorg_interval,
+        seed=args.seed,
+    )
+    async with network:
+        swarm = Swarm()
+        network.configure(swarm)
+        try:
+            # Warm up the seed and node list so they are not part of the results
+            await swarm.node_registry.ensure_loaded()
+            results = [
+                await drive(swarm, name, accounts, args.requests, args.concurrency)
+                for name in args.operation
+            ]
+        finally:
+            await swarm.close()
+            await close_client()
+
+    created = metrics.get("pysession_http_connections_created_total")
+    reused = metrics.get("pysession_http_connections_reused_total")
+    metrics.disable()
+    return {
+        "environment": environment(),
+        "network": {
+            "nodes": args.nodes,
+            "swarm_size": args.swarm_size,
+            "latency": args.latency,
+            "error_rate": args.error_rate,
+            "reorg_interval": args.reorg_interval,
+            "requests": network.requests,
+            "injected_errors": network.errors,
+            "redirects": network.redirects,
+        },
+        "swarm_cache": swarm.swarm_map.stats,
+        "connection_reuse": reused / (created + reused) if created + reused else 0,
+        "results": results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--operation",
+        choices=OPERATIONS,
+        action="append",
+        help="operation to measure, can be repeated (default: all)",
+    )
+    parser.add_argument("--nodes", type=int, default=30)
+    parser.add_argument("--swarm-size", type=int, default=5)
+    parser.add_argument("--accounts", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="median response delay in seconds"
+    )
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--reorg-interval", type=float, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as json to this file")
+    args = parser.parse_args(argv)
+    args.operation = args.operation or list(OPERATIONS)
+    return args
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    report = asyncio.run(main(arguments))
+
+    for result in report["results"]:
+        print(
+            f"{result['operation']:<9} {result['throughput']:>9.0f}/s"
+            f"  p50 {result.get('p50_ms', 0):7.2f} ms"
+            f"  p99 {result.get('p99_ms', 0):7.2f} ms"
+            f"  errors {sum(result['errors'].values())}"
+        )
+    print(f"connection reuse {report['connection_reuse']:.1%}")
+    print(f"swarm cache {report['swarm_cache']}")
+
+    if arguments.output:
+        with open(arguments.output, "w") as output:
+            json.dump(report, output, indent=2)
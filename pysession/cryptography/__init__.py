@@ -1 +1 @@
-from mnemonic import KeyPair
\ No newline at end of file
+from .mnemonic import KeyPair  # noqa: F401
@@ -0,0 +1,108 @@
+"""Derive many key pairs at once on multiple cores"""
+
+import os
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Union
+
+from .mnemonic import SEEDSIZE, KeyPair, MnemonicError
+
+# A mnemonic, a seed or None to generate a new seed
+KeySource = Union[str, bytes, None]
+
+
+class KeyRecord(NamedTuple):
+    """Derived keys of a single item, `error` is set when the item was invalid"""
+
+    position: int
+    public_key: bytes
+    secret_key: bytes
+    mnemonic: str
+    error: Optional[str] = None
+
+
+def _derive(position: int, source: KeySource, version: int, language: str) -> KeyRecord:
+    try:
+        if isinstance(source, str):
+            pair = KeyPair.from_words(source, version=version, language=language)
+            mnemonic = source
+        else:
+            seed = source if source is not None else os.urandom(SEEDSIZE)
+            pair = KeyPair.from_seed(seed, version=version, language=language)
+            mnemonic = pair.get_mnemonic()
+        # Keys are derived on first use, so derivation errors are raised here
+        public_key, secret_key = pair._pub, pair._sec
+    except (MnemonicError, ValueError) as e:
+        return KeyRecord(
+            position, b"", b"", source if isinstance(source, str) else "", str(e)
+        )
+
+    return KeyRecord(position, public_key, secret_key, mnemonic)
+
+
+def _derive_chunk(
+    start: int, sources: List[KeySource], version: int, language: str
+) -> List[KeyRecord]:
+    return [
+        _derive(start + i, source, version, language)
+        for i, source in enumerate(sources)
+    ]
+
+
+def _chunks(sources: Iterable[KeySource], chunk_size: int):
+    iterator = iter(sources)
+    start = 0
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield start, chunk
+        start += len(chunk)
+
+
+def derive_keys(
+    sources: Union[Iterable[KeySource], int],
+    version: int = 3,
+    language: str = "english",
+    workers: Optional[int] = None,
+    chunk_size: int = 256,
+    executor: Optional[Executor] = None,
+) -> Iterator[KeyRecord]:
+    """Derive key pairs from mnemonics, seeds or a number of new identities.
+
+    Work is split in chunks over a process pool and the records are yielded in
+    the order of the input while later chunks are still being derived. Invalid
+    items produce a record with `error` set instead of aborting the batch.
+    With `workers=0` everything runs in the calling process.
+    """
+    if isinstance(sources, int):
+        sources = (None for _ in range(sources))
+
+    if workers == 0 and executor is None:
+        for start, chunk in _chunks(sources, chunk_size):
+            yield from _derive_chunk(start, chunk, version, language)
+        return
+
+    owned = executor is None
+    if executor is None:
+        executor = ProcessPoolExecutor(workers)
+    workers = workers or os.cpu_count() or 1
+
+    # Keep a bounded number of chunks in flight to limit memory usage
+    pending: deque = deque()
+    try:
+        for start, chunk in _chunks(sources, chunk_size):
+            pending.append(
+                executor.submit(_derive_chunk, start, chunk, version, language)
+            )
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+        if owned:
+            executor.shutdown(wait=True)
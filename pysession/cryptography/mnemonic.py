@@ -1,11 +1,14 @@
 import json
-import math
 import os
+import threading
 import zlib
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
 
 import nacl.public
 import nacl.signing
-from nacl import encoding
+
+from ..metrics import metrics
 
 SEEDSIZE = 16
 
@@ -21,15 +24,44 @@ def swap_endian_bytes(hex_string):
     return hex_string[6:8] + hex_string[4:6] + hex_string[2:4] + hex_string[0:2]
 
 
-class KeyPair:
-    def __init__(self, version: int = 3, language: str = "english"):
+class Language:
+    """Wordlist of a mnemonic language with precomputed lookup tables"""
+
+    __slots__ = ("name", "prefix_length", "words", "indices", "prefixes")
+
+    def __init__(self, name: str, prefix_length: int, words: Tuple[str, ...]):
+        self.name = name
+        self.prefix_length = prefix_length
+        self.words = words
+        self.indices: Dict[str, int] = {word: i for i, word in enumerate(words)}
+
+        # Words can be abbreviated to their unique prefix
+        self.prefixes: Dict[str, int] = {}
+        if prefix_length > 0:
+            for i, word in enumerate(words):
+                self.prefixes.setdefault(word[:prefix_length], i)
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def index(self, word: str) -> Optional[int]:
+        """Index of a word or of an abbreviation of at least `prefix-length` letters"""
+        index = self.indices.get(word)
+        if index is None and 0 < self.prefix_length <= len(word):
+            index = self.prefixes.get(word[: self.prefix_length])
+            if index is not None and not self.words[index].startswith(word):
+                index = None
+        return index
+
+    @classmethod
+    def from_file(cls, name: str) -> "Language":
         current = os.path.dirname(os.path.abspath(__file__))
-        mnemonic_path = os.path.join(current, "languages", f"{language}.json")
+        mnemonic_path = os.path.join(current, "languages", f"{name}.json")
         try:
             # Attempt reading the file
             with open(mnemonic_path, "r") as mnemonic_file:
                 # Read the json file
-                self.language_set = json.load(mnemonic_file)
+                language_set = json.load(mnemonic_file)
 
         # Handle general parsing exceptions
         except FileNotFoundError as e:
@@ -38,21 +70,139 @@ class KeyPair:
             raise MnemonicError("Language file could not be decoded") from e
 
         # Verify if all required keys are in the language file
-        if not all(key in self.language_set for key in ("prefix-length", "words")):
+        if not all(key in language_set for key in ("prefix-length", "words")):
             raise MnemonicError("Invalid language file")
 
-        self.prefix_length = self.language_set["prefix-length"]
-        self.wordset = self.language_set["words"]
+        return cls(name, language_set["prefix-length"], tuple(language_set["words"]))
+
+
+# Languages are loaded once per process and shared between key pairs
+_languages: Dict[str, Language] = {}
+_languages_lock = threading.Lock()
+
+
+def get_language(name: str) -> Language:
+    language = _languages.get(name)
+    if language is None:
+        with _languages_lock:
+            language = _languages.get(name)
+            if language is None:
+                language = _languages[name] = Language.from_file(name)
+    return language
+
+
+def checksum_index(words: Sequence[str], prefix_length: int) -> int:
+    """Index of the word that is repeated as checksum"""
+    trimmed = "".join(word[:prefix_length] for word in words)
+    return zlib.crc32(trimmed.encode("ascii")) % len(words)
+
+
+def _resolve_language(language: Union[str, Language]) -> Language:
+    return get_language(language) if isinstance(language, str) else language
+
+
+def seed_to_words(seed: bytes, language: Union[str, Language] = "english") -> List[str]:
+    """Encode a seed as mnemonic words, including the checksum word.
+
+    Every 4 bytes of the seed are read as a little endian integer and encoded
+    as 3 words.
+    """
+    if len(seed) % 4 != 0:
+        raise MnemonicError("Invalid seed length")
+
+    language = _resolve_language(language)
+    wordset = language.words
+    n = len(wordset)
+
+    output = []
+    for i in range(0, len(seed), 4):
+        section = int.from_bytes(seed[i : i + 4], "little")
+        word1 = section % n
+        word2 = (section // n + word1) % n
+        word3 = (section // n // n + word2) % n
+        output += (wordset[word1], wordset[word2], wordset[word3])
+
+    if language.prefix_length > 0:
+        output.append(output[checksum_index(output, language.prefix_length)])
+
+    return output
+
+
+def words_to_seed(
+    words: Sequence[str], language: Union[str, Language] = "english"
+) -> bytes:
+    """Decode mnemonic words into the seed.
+
+    The last word is verified as checksum when the language has a prefix length.
+    Words have to be complete, see `KeyPair` for abbreviated words.
+    """
+    language = _resolve_language(language)
+    indices = language.indices
+    n = len(language.words)
+
+    if not words:
+        raise MnemonicError("Mnemonic seed is too short")
+
+    checksum = None
+    if language.prefix_length > 0:
+        *words, checksum = words
+
+    if not words or len(words) % 3 != 0:
+        raise MnemonicError("Mnemonic seed is too short")
+
+    try:
+        index = [indices[word] for word in words]
+    except KeyError as e:
+        raise MnemonicError(f"Invalid word `{e.args[0]}` in mnemonic") from e
+
+    seed = bytearray()
+    for i in range(0, len(index), 3):
+        word1, word2, word3 = index[i : i + 3]
+        segment = word1 + n * ((word2 - word1) % n) + n * n * ((word3 - word2) % n)
+
+        # This error will occour when you use abbey 13 times in your mnemonic
+        if segment % n != word1:
+            raise MnemonicError(
+                "Something went wrong when decoding your private key, please try again"
+            )
+
+        # Values above 32 bits are truncated like the reference implementation
+        seed += (segment & 0xFFFFFFFF).to_bytes(4, "little")
+
+    if checksum is not None:
+        expected_word = words[checksum_index(words, language.prefix_length)]
+        if expected_word != checksum:
+            raise MnemonicError(
+                "Your private key could not be verified, please verify the checksum word"
+            )
+
+    return bytes(seed)
+
+
+class KeyPair:
+    # Number of recipients to keep a precomputed shared key for
+    box_cache_size = 1024
+
+    def __init__(self, version: int = 3, language: str = "english"):
+        self.wordlist = get_language(language)
+        self.prefix_length = self.wordlist.prefix_length
+        self.wordset = self.wordlist.words
         self.version = version
         self.language = language
 
+        if version not in (2, 3):
+            raise MnemonicError("Unknown seed version")
+
+        self._seed_bytes: Optional[bytes] = None
+        self._reset_keys()
+
     def load_words(self, words):
         self.words = words
         # Self explainatory
+        # Keys are generated on first use
         self._verify_mnemonic()
         self._extract_checksum()
         self._decode_mnemonic()
-        self._generate_keys()
 
     def get_mnemonic(self):
         return " ".join(self.words)
@@ -60,47 +210,139 @@ class KeyPair:
     def get_public_key(self):
         return self._pub.hex()
 
+    @property
+    def _seed(self) -> Optional[bytes]:
+        return self._seed_bytes
+
+    @_seed.setter
+    def _seed(self, seed: bytes):
+        # Keys of the previous seed are no longer valid
+        self._seed_bytes = seed
+        self._reset_keys()
+
+    @property
+    def _seed32(self) -> str:
+        return self._seed.hex()
+
+    @_seed32.setter
+    def _seed32(self, seed: str):
+        self._seed = bytes.fromhex(seed)
+
+    @property
+    def _pub(self) -> bytes:
+        if self._pub_bytes is None:
+            self._generate_keys()
+        return self._pub_bytes
+
+    @property
+    def _sec(self) -> bytes:
+        return self.private_key.encode()
+
+    @property
+    def private_key(self) -> nacl.public.PrivateKey:
+        """X25519 private key used for encryption"""
+        if self._private_key is None:
+            self._generate_keys()
+        return self._private_key
+
+    @property
+    def signing_key(self) -> nacl.signing.SigningKey:
+        """Ed25519 signing key, only available for version 3 seeds"""
+        if self.version != 3:
+            raise MnemonicError("Only version 3 seeds have a signing key")
+        if self._signing_key is None:
+            self._generate_keys()
+        return self._signing_key
+
+    def sign(self, message: bytes) -> bytes:
+        """Sign a message and return the 64 byte signature"""
+        return self.signing_key.sign(message).signature
+
+    def encrypt(self, recipient: Union[str, bytes], plaintext: bytes) -> bytes:
+        """Encrypt a message for a session public key. The nonce is prepended"""
+        return self._box(recipient).encrypt(plaintext)
+
+    def decrypt(self, sender: Union[str, bytes], ciphertext: bytes) -> bytes:
+        """Decrypt a message created by `encrypt` of the sender"""
+        return self._box(sender).decrypt(ciphertext)
+
+    def encrypt_many(
+        self, recipients: Iterable[Union[str, bytes]], plaintext: bytes
+    ) -> Dict[Union[str, bytes], bytes]:
+        """Encrypt the same message for multiple recipients"""
+        return {
+            recipient: self.encrypt(recipient, plaintext) for recipient in recipients
+        }
+
+    def _box(self, public_key: Union[str, bytes]) -> nacl.public.Box:
+        """Box with the precomputed shared key of a session public key"""
+        key = bytes.fromhex(public_key) if isinstance(public_key, str) else public_key
+
+        box = self._boxes.get(key)
+        if box is not None:
+            self._boxes.move_to_end(key)
+            return box
+
+        if len(key) != 33 or key[0] != 5:
+            raise MnemonicError(f"Invalid session public key `{public_key!r}`")
+
+        box = nacl.public.Box(self.private_key, nacl.public.PublicKey(key[1:]))
+        self._boxes[key] = box
+        while len(self._boxes) > self.box_cache_size:
+            self._boxes.popitem(last=False)
+        return box
+
+    def _reset_keys(self):
+        self._pub_bytes: Optional[bytes] = None
+        self._private_key: Optional[nacl.public.PrivateKey] = None
+        self._signing_key: Optional[nacl.signing.SigningKey] = None
+        self._boxes: "OrderedDict[bytes, nacl.public.Box]" = OrderedDict()
+
     def _generate_v3_keys(self):
-        # Extract the seed from the 32hex seed string
-        seed64 = (self._seed32 + "0" * 32 + self._seed32)[:64]
+        # Pad the seed with zeros to 32 bytes
+        seed = (self._seed + bytes(16) + self._seed)[:32]
 
         # Create the public & private key
-        ed25519_keypair = nacl.signing.SigningKey(seed64, encoder=encoding.HexEncoder)
+        ed25519_keypair = nacl.signing.SigningKey(seed)
         ed25519_pub_key = ed25519_keypair.verify_key
 
-        # Convert keys to their bytecode
+        # Convert keys to their curve25519 counterparts
         X25519_pub = ed25519_pub_key.to_curve25519_public_key().encode()
-        X25519_sec = ed25519_keypair.to_curve25519_private_key().encode()
+        X25519_sec = ed25519_keypair.to_curve25519_private_key()
 
         # Add prefix to the public key
         prependedX25519_pub = b"\x05" + X25519_pub
 
-        self._pub = prependedX25519_pub
-        self._sec = X25519_sec
+        self._signing_key = ed25519_keypair
+        self._private_key = X25519_sec
+        self._pub_bytes = prependedX25519_pub
 
     def _generate_v2_keys(self):
         # Double the trouble
-        seed64 = (self._seed32 + self._seed32)[:64]
+        seed = (self._seed + self._seed)[:32]
 
         # Create a curve from the seed
-        curve25519_keypair = nacl.public.PrivateKey(seed64, encoding.HexEncoder)
+        curve25519_keypair = nacl.public.PrivateKey(seed)
 
         curve25519_pub = curve25519_keypair.public_key.encode()
-        curve25519_sec = curve25519_keypair.encode()
 
         # Add prefix to the public KeyboardInterrupt
         prepended_curve25519_pub = b"\x05" + curve25519_pub
 
-        self._pub = prepended_curve25519_pub
-        self._sec = curve25519_sec
+        self._private_key = curve25519_keypair
+        self._pub_bytes = prepended_curve25519_pub
 
     def _generate_keys(self):
-        if self.version == 3:
-            self._generate_v3_keys()
-        elif self.version == 2:
-            self._generate_v2_keys()
-        else:
-            raise MnemonicError("Unknown seed version")
+        if self._seed is None:
+            raise MnemonicError("No seed loaded")
+
+        with metrics.timer("pysession_key_derivation_seconds", version=self.version):
+            if self.version == 3:
+                self._generate_v3_keys()
+            elif self.version == 2:
+                self._generate_v2_keys()
+            else:
+                raise MnemonicError("Unknown seed version")
 
     def _extract_checksum(self):
 
@@ -109,83 +351,19 @@ class KeyPair:
             self.checksum = self.words.pop()
 
     def _get_checksum_index(self, wordlist):
-        trimmed = ""
-        for word in wordlist:
-            trimmed += word[: self.prefix_length]
-
-        checksum = zlib.crc32(bytes(trimmed, "ascii"))
-
-        return checksum % len(wordlist)
+        return checksum_index(wordlist, self.prefix_length)
 
     def _decode_mnemonic(self):
         # TODO: check if this works for other languages
-        # Prefix length isn't even doing anything
-
-        word_count = len(self.words)
-        wordset_length = len(self.wordset)
-        output = ""
-
-        for i in range(0, word_count, 3):
-            word1 = self.wordset.index(self.words[i])
-            word2 = self.wordset.index(self.words[i + 1])
-            word3 = self.wordset.index(self.words[i + 2])
-
-            segment = (
-                word1
-                + wordset_length * ((wordset_length - word1 + word2) % wordset_length)
-                + wordset_length
-                * wordset_length
-                * ((wordset_length - word2 + word3) % wordset_length)
-            )
-
-            # This error will occour when you use abbey 13 times in your mnemonic
-            if segment % wordset_length != word1:
-                raise MnemonicError(
-                    "Something went wrong when decoding your private key, please try again"
-                )
-
-            # Convert number to hex with a constant length
-            segment_hex = ("0" * 8 + hex(segment)[2:])[-8:]
-
-            # Swap endian 4 bytes
-            # Append swapped bytes to the output
-            output += swap_endian_bytes(segment_hex)
-
+        words = self.words
         if self.prefix_length > 0:
-            index = self._get_checksum_index(self.words)
-            expected_word = self.words[index]
-            if expected_word != self.checksum:
-                raise MnemonicError(
-                    "Your private key could not be verified, please verify the checksum word"
-                )
+            words = words + [self.checksum]
 
-        self._seed32 = output
-        return output
+        self._seed = words_to_seed(words, self.wordlist)
+        return self._seed32
 
     def _encode_mnemonic(self):
-        output = []
-        wordset_length = len(self.wordset)
-        seed = self._seed32
-        seed_length = len(self._seed32)  # probably 32
-
-        for i in range(0, seed_length, 8):
-            seed = seed[:i] + swap_endian_bytes(seed[i : i + 8]) + seed[i + 8 :]
-
-        for i in range(0, seed_length, 8):
-            section = int(seed[i : i + 8], 16)
-            word1 = section % wordset_length
-            word2 = (math.floor(section / wordset_length) + word1) % wordset_length
-            word3 = (
-                math.floor(math.floor(section / wordset_length) / wordset_length)
-                + word2
-            ) % wordset_length
-
-            output += [self.wordset[word1], self.wordset[word2], self.wordset[word3]]
-
-        if self.prefix_length > 0:
-            output.append(output[self._get_checksum_index(output)])
-
-        self.words = output
+        self.words = seed_to_words(self._seed, self.wordlist)
 
     def _verify_mnemonic(self):
         word_count = len(self.words)
@@ -199,9 +377,14 @@ class KeyPair:
             raise MnemonicError("Last word in Menmonic seed is missing")
 
         # Check if all the words of the seed are in the wordset
-        for i in range(word_count):
-            if not self.words[i] in self.wordset:
-                raise MnemonicError(f"Invalid word `{self.words[i]}` in mnemonic")
+        # and expand abbreviated words
+        words = []
+        for word in self.words:
+            index = self.wordlist.index(word)
+            if index is None:
+                raise MnemonicError(f"Invalid word `{word}` in mnemonic")
+            words.append(self.wordset[index])
+        self.words = words
 
     @classmethod
     def from_words(cls, words, **kwargs):
@@ -238,15 +421,22 @@ class KeyPair:
 
         return pair
 
+    @classmethod
+    def from_seed(cls, seed: bytes, **kwargs):
+        if len(seed) != SEEDSIZE:
+            raise MnemonicError(f"Seed must be {SEEDSIZE} bytes long")
+        pair = KeyPair(**kwargs)
+        pair._seed = seed
+        pair._encode_mnemonic()
+        return pair
+
     @classmethod
     def new_keys(cls, **kwargs):
         pair = KeyPair(**kwargs)
 
         # Hacky way to generate a keypair
-        pair._seed32 = os.urandom(SEEDSIZE).hex()
-        pair._encode_mnemonic()  # Create words from the hexstring
-
-        # Generate keys from the hex string
-        pair._generate_keys()
+        pair._seed = os.urandom(SEEDSIZE)
+        pair._encode_mnemonic()  # Create words from the seed
 
+        # Keys are generated on first use
         return pair
@@ -0,0 +1,424 @@
+"""Recover mnemonics with one or two unknown or mistyped words.
+
+Unknown words are written as `?`, misspelled words are detected because they are
+not in the wordlist. Every combination of candidate words is first checked
+against the checksum word and against the 32 bit range of its 3 word segments,
+which only takes a few xor operations. Keys are only derived for the survivors
+when a public key has to be matched.
+"""
+
+import os
+import zlib
+from concurrent.futures import Executor, ProcessPoolExecutor, wait
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from nacl import bindings
+
+from .mnemonic import Language, MnemonicError, checksum_index, get_language
+
+UNKNOWN = "?"
+MAX_UNKNOWN = 2
+SEGMENT_LIMIT = 0xFFFFFFFF
+FIELD_PRIME = 2**255 - 19
+
+# Searches with fewer combinations are not worth starting processes for
+INLINE_COMBINATIONS = 100_000
+
+
+class Recovery(NamedTuple):
+    """A mnemonic that passes all checks, with the words that were replaced"""
+
+    mnemonic: str
+    seed: bytes
+    replaced: Tuple[Tuple[int, str], ...]
+    distance: int
+
+
+def edit_distance(a: str, b: str) -> int:
+    """Levenshtein distance between two words"""
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(
+                min(
+                    previous[j] + 1,
+                    current[j - 1] + 1,
+                    previous[j - 1] + (char_a != char_b),
+                )
+            )
+        previous = current
+    return previous[-1]
+
+
+def rank_words(word: Optional[str], language: Language) -> List[Tuple[int, int]]:
+    """(distance, index) of all words, the nearest and longest common prefix first"""
+    if word is None:
+        return [(0, index) for index in range(len(language))]
+
+    ranked = []
+    for index, candidate in enumerate(language.words):
+        common = len(os.path.commonprefix([word, candidate]))
+        ranked.append((edit_distance(word, candidate), -common, index))
+    ranked.sort()
+    return [(distance, index) for distance, _, index in ranked]
+
+
+def public_key_from_seed(seed: bytes, version: int = 3) -> bytes:
+    """Session public key of a seed, without creating a `KeyPair`"""
+    if version == 3:
+        public_key, _ = bindings.crypto_sign_seed_keypair((seed + bytes(16))[:32])
+        return b"\x05" + bindings.crypto_sign_ed25519_pk_to_curve25519(public_key)
+    if version == 2:
+        return b"\x05" + bindings.crypto_scalarmult_base((seed + seed)[:32])
+    raise MnemonicError("Unknown seed version")
+
+
+def _matcher(public_key: bytes, version: int) -> Callable[[bytes], bool]:
+    """Check if a seed belongs to a session public key.
+
+    Version 3 keys are compared as ed25519 keys, which skips the conversion to
+    x25519 for every candidate. Only the y coordinate is compared as the sign of
+    x is lost in the x25519 key.
+    """
+    if version != 3:
+        return lambda seed: public_key_from_seed(seed, version) == public_key
+
+    u = int.from_bytes(public_key[1:], "little")
+    y = ((u - 1) * pow(u + 1, FIELD_PRIME - 2, FIELD_PRIME) % FIELD_PRIME).to_bytes(
+        32, "little"
+    )
+    head, last = y[:31], y[31]
+
+    def match(seed: bytes) -> bool:
+        ed25519, _ = bindings.crypto_sign_seed_keypair(seed + bytes(16))
+        return ed25519[:31] == head and ed25519[31] & 0x7F == last
+
+    return match
+
+
+def _segment_valid(word1: int, word2: int, word3: int, n: int) -> bool:
+    return word1 + n * ((word2 - word1) % n) + n * n * ((word3 - word2) % n) <= (
+        SEGMENT_LIMIT
+    )
+
+
+def _seed(indices: Sequence[int], n: int) -> bytes:
+    seed = bytearray()
+    for i in range(0, len(indices), 3):
+        word1, word2, word3 = indices[i : i + 3]
+        segment = word1 + n * ((word2 - word1) % n) + n * n * ((word3 - word2) % n)
+        seed += segment.to_bytes(4, "little")
+    return bytes(seed)
+
+
+class _Task(NamedTuple):
+    language: str
+    version: int
+    # Word indices, -1 at the unknown positions
+    data: Tuple[int, ...]
+    # Index of the checksum word, -1 when it is unknown or there is none
+    checksum: int
+    positions: Tuple[int, ...]
+    second: Tuple[int, ...]
+    public_key: Optional[bytes]
+
+
+def _checksum_terms(task: _Task, language: Language):
+    """Crc32 of the known words and the crc32 terms of every candidate word.
+
+    The crc32 of equally long messages is affine, so the checksum of a
+    combination is the xor of the base with the terms of its words.
+    """
+    length = language.prefix_length
+    prefixes = [word[:length].encode("ascii") for word in language.words]
+    if any(len(prefix) != length for prefix in prefixes):
+        return None
+
+    size = length * len(task.data)
+    zero = zlib.crc32(bytes(size))
+    base = zlib.crc32(
+        b"".join(prefixes[i] if i >= 0 else bytes(length) for i in task.data)
+    )
+
+    def terms(position: int) -> List[int]:
+        message = bytearray(size)
+        result = []
+        for prefix in prefixes:
+            message[position * length : (position + 1) * length] = prefix
+            result.append(zlib.crc32(message) ^ zero)
+        return result
+
+    return base, [terms(position) for position in task.positions]
+
+
+def _search(task: _Task, first: Sequence[int]) -> List[Tuple[int, ...]]:
+    """Combinations of candidates that pass the checksum and segment checks"""
+    language = get_language(task.language)
+    n = len(language)
+    data = list(task.data)
+    count = len(data)
+    positions = task.positions
+    second = task.second if len(positions) > 1 else (-1,)
+
+    has_checksum = language.prefix_length > 0
+    terms = _checksum_terms(task, language) if has_checksum else None
+
+    # Both unknown words in the same segment have to be checked together
+    shared = len(positions) > 1 and positions[0] // 3 == positions[1] // 3
+    segment = positions[0] // 3 * 3
+
+    match = None
+    if task.public_key is not None:
+        match = _matcher(task.public_key, task.version)
+
+    found = []
+    for a in first:
+        data[positions[0]] = a
+        base = None
+        if terms is not None:
+            base = terms[0] ^ terms[1][0][a]
+
+        for b in second:
+            if b >= 0:
+                data[positions[1]] = b
+            if shared and not _segment_valid(*data[segment : segment + 3], n):
+                continue
+
+            if has_checksum:
+                if base is not None:
+                    crc = base ^ terms[1][1][b] if b >= 0 else base
+                else:
+                    trimmed = "".join(
+                        language.words[i][: language.prefix_length] for i in data
+                    )
+                    crc = zlib.crc32(trimmed.encode("ascii"))
+                checksum = data[crc % count]
+                if task.checksum >= 0 and checksum != task.checksum:
+                    continue
+
+            if match is not None:
+                # Only one mnemonic belongs to a public key
+                if match(_seed(data, n)):
+                    return [(a, b) if b >= 0 else (a,)]
+                continue
+
+            found.append((a, b) if b >= 0 else (a,))
+    return found
+
+
+def _candidates(
+    position: int, ranked: List[Tuple[int, int]], data: List[int], n: int, both: bool
+) -> Tuple[int, ...]:
+    """Candidate words of a position, without those giving an invalid segment"""
+    if both:
+        return tuple(index for _, index in ranked)
+
+    start = position // 3 * 3
+    words = data[start : start + 3]
+    candidates = []
+    for _, index in ranked:
+        words[position - start] = index
+        if _segment_valid(*words, n):
+            candidates.append(index)
+    return tuple(candidates)
+
+
+def recover(
+    words: Union[str, Sequence[str]],
+    public_key: Optional[Union[str, bytes]] = None,
+    unknown: Iterable[int] = (),
+    language: str = "english",
+    version: int = 3,
+    limit: Optional[int] = None,
+    workers: Optional[int] = None,
+    chunk_size: int = 64,
+    executor: Optional[Executor] = None,
+) -> List[Recovery]:
+    """Find the mnemonics that match the words, nearest candidates first.
+
+    Positions in `unknown`, words that are `?` and words that are not in the
+    wordlist are searched. When all words are valid but the checksum or the public
+    key does not match, every position is tried on its own, including the
+    checksum word. With `public_key` only mnemonics of that key are returned and
+    the search stops at the first match. With `workers=0` everything runs in the
+    calling process.
+    """
+    wordlist = get_language(language)
+    n = len(wordlist)
+    typed = words.split() if isinstance(words, str) else list(words)
+    unknown = set(unknown)
+
+    indices: List[int] = []
+    hints: Dict[int, Optional[str]] = {}
+    for position, word in enumerate(typed):
+        index = None
+        if word != UNKNOWN and position not in unknown:
+            index = wordlist.index(word)
+        if index is None:
+            hints[position] = None if word == UNKNOWN else word
+        indices.append(-1 if index is None else index)
+
+    checksum = -1
+    if wordlist.prefix_length > 0:
+        checksum = indices.pop()
+    if not indices or len(indices) % 3 != 0:
+        raise MnemonicError("Mnemonic seed is too short")
+
+    if isinstance(public_key, str):
+        public_key = bytes.fromhex(public_key)
+
+    positions = [position for position in range(len(indices)) if indices[position] < 0]
+    if len(positions) > MAX_UNKNOWN:
+        raise MnemonicError(f"Only {MAX_UNKNOWN} unknown words can be recovered")
+
+    results: List[Recovery] = []
+    if positions:
+        plans = [tuple(positions)]
+    else:
+        # The typed data words, if their segments are valid and belong to the key
+        matches = _valid(indices, -1, wordlist) and (
+            public_key is None or _matcher(public_key, version)(_seed(indices, n))
+        )
+        if matches and _valid(indices, checksum, wordlist):
+            # The checksum word is computed when it is unknown or misspelled
+            task = _Task(
+                language, version, tuple(indices), checksum, (), (), public_key
+            )
+            return [_recovery(task, (), {}, typed, wordlist)]
+
+        # A word was mistyped into another valid word, try every position
+        plans = [(position,) for position in range(len(indices))]
+        for position in range(len(indices)):
+            hints[position] = wordlist.words[indices[position]]
+
+        # That word can be the checksum word itself
+        if matches and checksum >= 0:
+            task = _Task(language, version, tuple(indices), -1, (), (), public_key)
+            results.append(_recovery(task, (), {}, typed, wordlist))
+            if public_key is not None:
+                return results
+
+    for plan in plans:
+        data = list(indices)
+        for position in plan:
+            data[position] = -1
+
+        ranked = {
+            position: rank_words(hints.get(position), wordlist) for position in plan
+        }
+        both = len(plan) > 1 and plan[0] // 3 == plan[1] // 3
+        candidates = [
+            _candidates(position, ranked[position], data, n, both) for position in plan
+        ]
+        task = _Task(
+            language,
+            version,
+            tuple(data),
+            checksum,
+            plan,
+            candidates[1] if len(plan) > 1 else (),
+            public_key,
+        )
+
+        found = _run(task, candidates[0], workers, chunk_size, executor)
+        distances = {
+            position: {index: distance for distance, index in ranked[position]}
+            for position in plan
+        }
+        results.extend(
+            _recovery(task, combination, distances, typed, wordlist)
+            for combination in found
+        )
+        if public_key is not None and results:
+            break
+
+    results.sort(key=lambda recovery: recovery.distance)
+    return results[:limit] if limit is not None else results
+
+
+def _valid(indices: List[int], checksum: int, wordlist: Language) -> bool:
+    n = len(wordlist)
+    segments = (indices[i : i + 3] for i in range(0, len(indices), 3))
+    if not all(_segment_valid(*segment, n) for segment in segments):
+        return False
+    if checksum < 0:
+        return True
+    words = [wordlist.words[index] for index in indices]
+    return (
+        words[checksum_index(words, wordlist.prefix_length)] == wordlist.words[checksum]
+    )
+
+
+def _recovery(task, combination, distances, typed, wordlist) -> Recovery:
+    n = len(wordlist)
+    data = list(task.data)
+
+    distance = 0
+    for position, index in zip(task.positions, combination):
+        data[position] = index
+        distance += distances[position][index]
+
+    words = [wordlist.words[index] for index in data]
+    replaced = [(position, words[position]) for position in task.positions]
+    if wordlist.prefix_length > 0:
+        checksum_word = words[checksum_index(words, wordlist.prefix_length)]
+        if task.checksum < 0:
+            replaced.append((len(words), checksum_word))
+            typed_checksum = typed[len(words)]
+            if typed_checksum != UNKNOWN:
+                distance += edit_distance(typed_checksum, checksum_word)
+        words.append(checksum_word)
+
+    return Recovery(" ".join(words), _seed(data, n), tuple(replaced), distance)
+
+
+def _run(
+    task: _Task,
+    first: Sequence[int],
+    workers: Optional[int],
+    chunk_size: int,
+    executor: Optional[Executor],
+) -> List[Tuple[int, ...]]:
+    """Search the candidates of the first position in chunks over a process pool"""
+    combinations = len(first) * max(1, len(task.second))
+    if executor is None and (workers == 0 or combinations <= INLINE_COMBINATIONS):
+        return _search(task, first)
+
+    owned = executor is None
+    if executor is None:
+        executor = ProcessPoolExecutor(workers)
+    futures = [
+        executor.submit(_search, task, first[i : i + chunk_size])
+        for i in range(0, len(first), chunk_size)
+    ]
+    try:
+        if task.public_key is not None:
+            # Stop at the first chunk with a match
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, return_when="FIRST_COMPLETED")
+                for future in done:
+                    if future.result():
+                        return future.result()
+            return []
+
+        found: List[Tuple[int, ...]] = []
+        for future in futures:
+            found.extend(future.result())
+        return found
+    finally:
+        for future in futures:
+            future.cancel()
+        if owned:
+            executor.shutdown(wait=True)
@@ -0,0 +1,172 @@
+"""Opt-in metrics of requests, swarm lookups and key derivation.
+
+Instrumented code checks `metrics.enabled` before recording anything, so metrics
+cost a single attribute lookup while they are disabled. Recorded values are passed
+to listeners and can be exported in the Prometheus text format with `render`.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Upper bounds in seconds of the histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# Called with the metric name, the increment or observed value and the labels
+Listener = Callable[[str, float, Dict[str, str]], None]
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * len(self.bounds)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.bounds, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """(upper bound, number of values below it) including +Inf"""
+        buckets = []
+        total = 0
+        for bound, count in zip(self.bounds, self.counts):
+            total += count
+            buckets.append((_format_value(bound), total))
+        buckets.append(("+Inf", self.count))
+        return buckets
+
+
+class Metrics:
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.enabled = False
+        self.buckets = tuple(buckets)
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self.listeners: List[Listener] = []
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def add_listener(self, listener: Listener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener: Listener):
+        self.listeners.remove(listener)
+
+    def inc(self, name: str, value: float = 1, **labels: str):
+        key = _labels(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+        self._notify(name, value, labels)
+
+    def observe(self, name: str, value: float, **labels: str):
+        key = _labels(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(self.buckets)
+            histogram.observe(value)
+        self._notify(name, value, labels)
+
+    @contextmanager
+    def timer(self, name: str, **labels: str) -> Iterator[None]:
+        """Observe the duration of the block, unless metrics are disabled"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def _notify(self, name: str, value: float, labels: Dict[str, str]):
+        for listener in self.listeners:
+            listener(name, value, labels)
+
+    def get(self, name: str, **labels: str) -> float:
+        """Value of a counter, 0 when nothing was recorded"""
+        return self.counters.get(name, {}).get(_labels(labels), 0)
+
+    def histogram(self, name: str, **labels: str) -> Optional[Histogram]:
+        return self.histograms.get(name, {}).get(_labels(labels))
+
+    def render(self, openmetrics: bool = False) -> str:
+        """Snapshot of all metrics in the Prometheus (or OpenMetrics) text format"""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f"# TYPE {_family(name, openmetrics)} counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(
+                        f"{name}{_format_labels(labels)} {_format_value(value)}"
+                    )
+
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in sorted(series.items()):
+                    for bound, count in histogram.cumulative():
+                        bucket_labels = _format_labels(labels + (("le", bound),))
+                        lines.append(f"{name}_bucket{bucket_labels} {count}")
+                    lines.append(
+                        f"{name}_sum{_format_labels(labels)} "
+                        f"{_format_value(histogram.sum)}"
+                    )
+                    lines.append(
+                        f"{name}_count{_format_labels(labels)} {histogram.count}"
+                    )
+
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _family(name: str, openmetrics: bool) -> str:
+    # OpenMetrics names the counter family without the _total suffix
+    if openmetrics and name.endswith("_total"):
+        return name[: -len("_total")]
+    return name
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+# Shared by all instrumented modules
+metrics = Metrics()
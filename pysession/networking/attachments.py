@@ -0,0 +1,384 @@
+"""Streaming transfer of large attachments between files and the network.
+
+Data is moved in fixed-size chunks, so memory usage does not depend on the size
+of the attachment. Attachments can be encrypted with libsodium's secretstream,
+which authenticates every chunk and marks the last one.
+"""
+
+import asyncio
+import json
+import os
+from contextlib import ExitStack
+from typing import AsyncIterator, Callable, List, Optional, Tuple, Union
+
+from nacl import bindings
+
+from .util import Client, get_client
+
+CHUNK_SIZE = 64 * 1024
+HEADER_SIZE = bindings.crypto_secretstream_xchacha20poly1305_HEADERBYTES
+OVERHEAD = bindings.crypto_secretstream_xchacha20poly1305_ABYTES
+TAG_FINAL = bindings.crypto_secretstream_xchacha20poly1305_TAG_FINAL
+TAG_MESSAGE = bindings.crypto_secretstream_xchacha20poly1305_TAG_MESSAGE
+
+# Called with the number of transferred bytes and the total when it is known
+ProgressCallback = Callable[[int, Optional[int]], None]
+
+
+class AttachmentError(Exception):
+    pass
+
+
+def generate_key() -> bytes:
+    return bindings.crypto_secretstream_xchacha20poly1305_keygen()
+
+
+class StreamEncryptor:
+    """Encrypts a stream chunk by chunk, starting with `header`"""
+
+    def __init__(self, key: bytes):
+        self._state = bindings.crypto_secretstream_xchacha20poly1305_state()
+        self.header = bindings.crypto_secretstream_xchacha20poly1305_init_push(
+            self._state, key
+        )
+
+    def push(self, chunk: bytes, final: bool = False) -> bytes:
+        tag = TAG_FINAL if final else TAG_MESSAGE
+        return bindings.crypto_secretstream_xchacha20poly1305_push(
+            self._state, chunk, None, tag
+        )
+
+
+class StreamDecryptor:
+    """Decrypts data produced with the same chunk size by `encrypt_chunks`"""
+
+    def __init__(self, key: bytes, chunk_size: int = CHUNK_SIZE):
+        self.key = key
+        self.block_size = chunk_size + OVERHEAD
+        self.finished = False
+        self._state = None
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> bytes:
+        """Add ciphertext and return the plaintext of all complete chunks"""
+        if self.finished and data:
+            raise AttachmentError("Data after the final chunk")
+        self._buffer += data
+
+        if self._state is None:
+            if len(self._buffer) < HEADER_SIZE:
+                return b""
+            self._state = bindings.crypto_secretstream_xchacha20poly1305_state()
+            bindings.crypto_secretstream_xchacha20poly1305_init_pull(
+                self._state, bytes(self._buffer[:HEADER_SIZE]), self.key
+            )
+            del self._buffer[:HEADER_SIZE]
+
+        output = bytearray()
+        while len(self._buffer) >= self.block_size and not self.finished:
+            output += self._pull(bytes(self._buffer[: self.block_size]))
+            del self._buffer[: self.block_size]
+        return bytes(output)
+
+    def finish(self) -> bytes:
+        """Decrypt the last, shorter chunk and verify the stream was complete"""
+        output = b""
+        if self._buffer and not self.finished and self._state is not None:
+            output = self._pull(bytes(self._buffer))
+            self._buffer.clear()
+        if not self.finished or self._buffer:
+            raise AttachmentError("Attachment is truncated")
+        return output
+
+    def _pull(self, block: bytes) -> bytes:
+        try:
+            plaintext, tag = bindings.crypto_secretstream_xchacha20poly1305_pull(
+                self._state, block, None
+            )
+        except Exception as e:
+            raise AttachmentError("Attachment could not be decrypted") from e
+        self.finished = tag == TAG_FINAL
+        return plaintext
+
+
+async def file_chunks(path: str, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+    with open(path, "rb") as source:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+async def _rechunk(
+    source: AsyncIterator[bytes], chunk_size: int
+) -> AsyncIterator[bytes]:
+    buffer = bytearray()
+    async for data in source:
+        buffer += data
+        while len(buffer) >= chunk_size:
+            yield bytes(buffer[:chunk_size])
+            del buffer[:chunk_size]
+    yield bytes(buffer)
+
+
+async def encrypt_chunks(
+    source: AsyncIterator[bytes], key: bytes, chunk_size: int = CHUNK_SIZE
+) -> AsyncIterator[bytes]:
+    """Encrypt a stream in chunks of exactly `chunk_size` plaintext bytes"""
+    encryptor = StreamEncryptor(key)
+    yield encryptor.header
+
+    # Look one chunk ahead to know which one is the last
+    previous = None
+    async for chunk in _rechunk(source, chunk_size):
+        if previous is not None:
+            yield encryptor.push(previous)
+        previous = chunk
+    yield encryptor.push(previous or b"", final=True)
+
+
+async def upload(
+    url: str,
+    source: Union[str, AsyncIterator[bytes]],
+    key: Optional[bytes] = None,
+    chunk_size: int = CHUNK_SIZE,
+    progress: Optional[ProgressCallback] = None,
+    client: Optional[Client] = None,
+    **kwargs,
+) -> bytes:
+    """Upload a file or an async iterator with a chunked post request"""
+    total = None
+    if isinstance(source, str):
+        if key is None:
+            total = os.path.getsize(source)
+        source = file_chunks(source, chunk_size)
+    if key is not None:
+        source = encrypt_chunks(source, key, chunk_size)
+
+    async def body():
+        sent = 0
+        async for chunk in source:
+            sent += len(chunk)
+            yield chunk
+            if progress is not None:
+                progress(sent, total)
+
+    client = client or get_client()
+    kwargs.setdefault("timeout", None)
+    async with client.post(url, data=body(), **kwargs) as response:
+        if response.status != 200:
+            raise AttachmentError(f"Upload failed with status {response.status}")
+        return await response.read()
+
+
+async def _probe(client: Client, url: str, **kwargs) -> Tuple[Optional[int], bool]:
+    """Size of the attachment and whether ranged requests are supported"""
+    try:
+        async with client.head(url, **kwargs) as response:
+            if response.status != 200:
+                return None, False
+            size = response.headers.get("Content-Length")
+            ranges = response.headers.get("Accept-Ranges") == "bytes"
+            return (int(size) if size else None), ranges
+    except Exception:
+        return None, False
+
+
+class _Transfer:
+    """Bookkeeping of a download that can be resumed"""
+
+    def __init__(self, path: str, size: Optional[int], segment_size: int):
+        self.part_path = path + ".part"
+        self.state_path = path + ".part.json"
+        # Plaintext of an encrypted attachment until it is complete
+        self.plain_path = path + ".part.plain"
+        self.size = size
+        self.segment_size = segment_size
+        self.done: List[int] = []
+
+    def load(self) -> bool:
+        try:
+            with open(self.state_path, "r") as state_file:
+                state = json.load(state_file)
+        except (OSError, ValueError):
+            return False
+        if (state.get("size"), state.get("segment_size")) != (
+            self.size,
+            self.segment_size,
+        ) or not os.path.exists(self.part_path):
+            return False
+        self.done = state.get("done", [])
+        return True
+
+    def save(self):
+        with open(self.state_path, "w") as state_file:
+            json.dump(
+                {
+                    "size": self.size,
+                    "segment_size": self.segment_size,
+                    "done": self.done,
+                },
+                state_file,
+            )
+
+    def cleanup(self):
+        for path in (self.part_path, self.state_path, self.plain_path):
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+async def download(
+    url: str,
+    path: str,
+    key: Optional[bytes] = None,
+    chunk_size: int = CHUNK_SIZE,
+    connections: int = 4,
+    resume: bool = True,
+    progress: Optional[ProgressCallback] = None,
+    client: Optional[Client] = None,
+    **kwargs,
+) -> int:
+    """Download an attachment to a file and return the number of bytes received.
+
+    When the server supports ranges the attachment is fetched in `connections`
+    parallel segments. Interrupted downloads continue from the `.part` file.
+
+    With a key a single stream is decrypted as it arrives. Segments arrive out of
+    order, so they are decrypted in a worker thread once all of them are complete.
+    """
+    client = client or get_client()
+    kwargs.setdefault("timeout", None)
+    size, ranges = await _probe(client, url, **kwargs)
+
+    parallel = ranges and size and connections > 1
+    segment_size = 0
+    if parallel:
+        # Segments are a multiple of the chunk size
+        per_connection = -(-size // connections)
+        segment_size = max(chunk_size, -(-per_connection // chunk_size) * chunk_size)
+
+    transfer = _Transfer(path, size, segment_size)
+    if not (resume and transfer.load()):
+        transfer.cleanup()
+
+    received = 0
+
+    def report(count: int):
+        nonlocal received
+        received += count
+        if progress is not None:
+            progress(received, size)
+
+    if parallel:
+        await _download_segments(client, url, transfer, chunk_size, report, **kwargs)
+        if key is not None:
+            await asyncio.get_running_loop().run_in_executor(
+                None,
+                _decrypt_file,
+                transfer.part_path,
+                transfer.plain_path,
+                key,
+                chunk_size,
+            )
+    else:
+        decryptor = StreamDecryptor(key, chunk_size) if key is not None else None
+        await _download_stream(
+            client, url, transfer, chunk_size, ranges, report, decryptor, **kwargs
+        )
+        if decryptor is not None:
+            with open(transfer.plain_path, "ab") as plain:
+                plain.write(decryptor.finish())
+
+    os.replace(transfer.plain_path if key is not None else transfer.part_path, path)
+    transfer.cleanup()
+
+    return received
+
+
+async def _download_segments(client, url, transfer, chunk_size, report, **kwargs):
+    size = transfer.size
+    if not os.path.exists(transfer.part_path):
+        with open(transfer.part_path, "wb") as part:
+            part.truncate(size)
+
+    starts = range(0, size, transfer.segment_size)
+    missing = [start for start in starts if start not in transfer.done]
+    base_headers = kwargs.pop("headers", {})
+
+    async def fetch(start: int):
+        end = min(start + transfer.segment_size, size) - 1
+        headers = {**base_headers, "Range": f"bytes={start}-{end}"}
+        async with client.get(url, headers=headers, **kwargs) as response:
+            if response.status != 206:
+                raise AttachmentError(f"Range request failed with {response.status}")
+            with open(transfer.part_path, "r+b") as part:
+                part.seek(start)
+                async for data in response.content.iter_chunked(chunk_size):
+                    part.write(data)
+                    report(len(data))
+
+        transfer.done.append(start)
+        transfer.save()
+
+    await asyncio.gather(*(fetch(start) for start in missing))
+
+
+async def _catch_up(transfer: _Transfer, decryptor: StreamDecryptor):
+    """Decrypt the ciphertext received before an interruption"""
+    await asyncio.get_running_loop().run_in_executor(
+        None, _decrypt_into, decryptor, transfer.part_path, transfer.plain_path
+    )
+
+
+async def _download_stream(
+    client, url, transfer, chunk_size, ranges, report, decryptor=None, **kwargs
+):
+    offset = 0
+    if ranges and os.path.exists(transfer.part_path):
+        offset = os.path.getsize(transfer.part_path)
+    if transfer.size is not None and offset >= transfer.size:
+        if decryptor is not None:
+            await _catch_up(transfer, decryptor)
+        return
+
+    headers = dict(kwargs.pop("headers", {}))
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+    transfer.save()
+
+    async with client.get(url, headers=headers, **kwargs) as response:
+        if response.status not in (200, 206):
+            raise AttachmentError(f"Download failed with status {response.status}")
+
+        # Start over when the server ignored the range
+        resumed = response.status == 206
+        if resumed and decryptor is not None:
+            await _catch_up(transfer, decryptor)
+
+        mode = "ab" if resumed else "wb"
+        with ExitStack() as files:
+            part = files.enter_context(open(transfer.part_path, mode))
+            if decryptor is not None:
+                plain = files.enter_context(open(transfer.plain_path, mode))
+            async for data in response.content.iter_chunked(chunk_size):
+                part.write(data)
+                if decryptor is not None:
+                    plain.write(decryptor.feed(data))
+                report(len(data))
+
+
+def _decrypt_into(decryptor: StreamDecryptor, source_path: str, target_path: str):
+    with open(source_path, "rb") as source, open(target_path, "wb") as target:
+        while True:
+            data = source.read(decryptor.block_size)
+            if not data:
+                break
+            target.write(decryptor.feed(data))
+
+
+def _decrypt_file(source_path: str, target_path: str, key: bytes, chunk_size: int):
+    decryptor = StreamDecryptor(key, chunk_size)
+    _decrypt_into(decryptor, source_path, target_path)
+    with open(target_path, "ab") as target:
+        target.write(decryptor.finish())
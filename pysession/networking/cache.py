@@ -0,0 +1,146 @@
+"""Bounded cache of swarms with background refreshing"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from ..metrics import metrics
+
+RefreshCallback = Callable[[str], Awaitable[Any]]
+
+
+class SwarmCache:
+    """LRU cache that maps public keys to their swarm.
+
+    Entries that are older than `refresh_after` seconds are still served while they
+    are refreshed in the background (stale-while-revalidate). Entries older than
+    `max_age` seconds are treated as missing.
+    """
+
+    def __init__(
+        self,
+        refresh: Optional[RefreshCallback] = None,
+        max_size: int = 10000,
+        ttl: float = 3600,
+        refresh_after: float = 0.8,
+        max_age: Optional[float] = None,
+    ):
+        self.refresh = refresh
+        self.max_size = max_size
+        self.ttl = ttl
+        self.refresh_after = ttl * refresh_after
+        self.max_age = max_age if max_age is not None else ttl * 2
+
+        # public key -> (updated_at, swarm)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._refreshing: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refreshes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, public_key: str) -> bool:
+        return public_key in self._entries
+
+    def get(self, public_key: str) -> Optional[Any]:
+        """Return the cached swarm or None, refreshing old entries in the background"""
+        entry = self._entries.get(public_key)
+        if entry is None:
+            self.misses += 1
+            if metrics.enabled:
+                metrics.inc("pysession_swarm_cache_lookups_total", result="miss")
+            return None
+
+        updated_at, swarm = entry
+        age = time.monotonic() - updated_at
+        if age > self.max_age:
+            del self._entries[public_key]
+            self.misses += 1
+            if metrics.enabled:
+                metrics.inc("pysession_swarm_cache_lookups_total", result="expired")
+            return None
+
+        self._entries.move_to_end(public_key)
+        self.hits += 1
+        if metrics.enabled:
+            metrics.inc("pysession_swarm_cache_lookups_total", result="hit")
+
+        if age > self.refresh_after:
+            self._schedule_refresh(public_key)
+
+        return swarm
+
+    def set(self, public_key: str, swarm: Any, age: float = 0.0):
+        """Store a swarm and evict the least recently used entries"""
+        self._entries[public_key] = (time.monotonic() - age, swarm)
+        self._entries.move_to_end(public_key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+            if metrics.enabled:
+                metrics.inc("pysession_swarm_cache_evictions_total")
+
+    def pop(self, public_key: str):
+        self._entries.pop(public_key, None)
+
+    def values(self):
+        return [swarm for _, swarm in self._entries.values()]
+
+    def items(self):
+        """(public key, age in seconds, swarm) from least to most recently used"""
+        now = time.monotonic()
+        return [
+            (public_key, now - updated_at, swarm)
+            for public_key, (updated_at, swarm) in self._entries.items()
+        ]
+
+    def _schedule_refresh(self, public_key: str):
+        if self.refresh is None or public_key in self._refreshing:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+
+        self._refreshing.add(public_key)
+        task = loop.create_task(self._refresh(public_key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refresh(self, public_key: str):
+        try:
+            swarm = await self.refresh(public_key)
+            if swarm:
+                self.set(public_key, swarm)
+                self.refreshes += 1
+                if metrics.enabled:
+                    metrics.inc("pysession_swarm_cache_refreshes_total")
+        except Exception:
+            # Keep serving the stale entry, it will be retried on the next lookup
+            pass
+        finally:
+            self._refreshing.discard(public_key)
+
+    async def close(self):
+        """Cancel all running background refreshes"""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "refreshes": self.refreshes,
+        }
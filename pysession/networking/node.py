@@ -0,0 +1,97 @@
+"""Compact records for service nodes"""
+
+from typing import Any, Dict, Optional, Tuple
+
+NodeKey = Tuple[str, int]
+
+
+class Node:
+    """Immutable service node with its storage url computed once.
+
+    Accepts both the oxend format (`public_ip`, `storage_port`) and the storage
+    server format (`ip`, `port`) through `Node.from_dict`.
+    """
+
+    __slots__ = ("ip", "port", "pubkey_ed25519", "pubkey_x25519", "swarm_id", "url")
+
+    ip: str
+    port: int
+    pubkey_ed25519: Optional[str]
+    pubkey_x25519: Optional[str]
+    swarm_id: Optional[int]
+    url: str
+
+    def __init__(
+        self,
+        ip: str,
+        port: int,
+        pubkey_ed25519: Optional[str] = None,
+        pubkey_x25519: Optional[str] = None,
+        swarm_id: Optional[int] = None,
+    ):
+        port = int(port)
+        set_attribute = object.__setattr__
+        set_attribute(self, "ip", ip)
+        set_attribute(self, "port", port)
+        set_attribute(self, "pubkey_ed25519", pubkey_ed25519)
+        set_attribute(self, "pubkey_x25519", pubkey_x25519)
+        set_attribute(self, "swarm_id", swarm_id)
+        set_attribute(self, "url", f"https://{ip}:{port}/storage_rpc/v1")
+
+    @classmethod
+    def from_dict(cls, node: Dict[str, Any]) -> "Node":
+        return cls(
+            node["public_ip"] if "public_ip" in node else node["ip"],
+            node["storage_port"] if "storage_port" in node else node["port"],
+            node.get("pubkey_ed25519"),
+            node.get("pubkey_x25519"),
+            node.get("swarm_id"),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Oxend formatted dict that `from_dict` accepts"""
+        return {
+            "public_ip": self.ip,
+            "storage_port": self.port,
+            "pubkey_ed25519": self.pubkey_ed25519,
+            "pubkey_x25519": self.pubkey_x25519,
+            "swarm_id": self.swarm_id,
+        }
+
+    @property
+    def key(self) -> NodeKey:
+        return self.ip, self.port
+
+    @property
+    def valid(self) -> bool:
+        """Nodes without a public ip can't be reached"""
+        return self.ip != "0.0.0.0"
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Node is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Node is immutable")
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Node):
+            return NotImplemented
+        return self.key == other.key
+
+    def __hash__(self) -> int:
+        return hash(self.key)
+
+    def __reduce__(self):
+        return (
+            Node,
+            (
+                self.ip,
+                self.port,
+                self.pubkey_ed25519,
+                self.pubkey_x25519,
+                self.swarm_id,
+            ),
+        )
+
+    def __repr__(self) -> str:
+        return f"Node({self.ip}:{self.port})"
@@ -0,0 +1,289 @@
+"""Onion requests routed through a pool of three hop paths.
+
+Every layer is encrypted with xchacha20-poly1305 using a key derived from an x25519
+exchange between an ephemeral key of that layer and the key of the hop. A hop
+receives `encode_blob(ciphertext, {"ephemeral_key": ..., "enc_type": ...})` on
+`/onion_req/v2`, decrypts it and finds either another blob with the `destination`
+(ed25519 public key) of the next hop, or the request body when it is the
+destination itself. The destination encrypts its response with the same key and
+every hop passes it back unchanged.
+"""
+
+import asyncio
+import json
+import random
+import struct
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+from urllib.parse import urlsplit
+
+import nacl.hash
+import nacl.public
+from nacl import bindings, encoding, utils
+
+from .node import Node
+from .util import Client, request_bytes
+
+ENC_TYPE = "xchacha20"
+NONCE_SIZE = bindings.crypto_aead_xchacha20poly1305_ietf_NPUBBYTES
+
+
+class OnionError(Exception):
+    pass
+
+
+def xchacha20_key(
+    secret: bytes, local_public: bytes, remote_public: bytes, local_first: bool = True
+) -> bytes:
+    """Shared symmetric key of an x25519 exchange as used by the storage server"""
+    shared = bindings.crypto_scalarmult(secret, remote_public)
+    first, second = (
+        (local_public, remote_public) if local_first else (remote_public, local_public)
+    )
+    return nacl.hash.blake2b(
+        shared + first + second, digest_size=32, encoder=encoding.RawEncoder
+    )
+
+
+def encrypt(key: bytes, plaintext: bytes) -> bytes:
+    nonce = utils.random(NONCE_SIZE)
+    return nonce + bindings.crypto_aead_xchacha20poly1305_ietf_encrypt(
+        plaintext, None, nonce, key
+    )
+
+
+def decrypt(key: bytes, data: bytes) -> bytes:
+    return bindings.crypto_aead_xchacha20poly1305_ietf_decrypt(
+        data[NONCE_SIZE:], None, data[:NONCE_SIZE], key
+    )
+
+
+def encode_blob(ciphertext: bytes, meta: Dict[str, Any]) -> bytes:
+    """Length prefixed ciphertext followed by json routing data"""
+    return struct.pack("<I", len(ciphertext)) + ciphertext + json.dumps(meta).encode()
+
+
+def decode_blob(data: bytes) -> Tuple[bytes, Dict[str, Any]]:
+    if len(data) < 4:
+        raise OnionError("Onion blob is too short")
+    (size,) = struct.unpack("<I", data[:4])
+    if len(data) < 4 + size:
+        raise OnionError("Onion blob is truncated")
+    return data[4 : 4 + size], json.loads(data[4 + size :] or b"{}")
+
+
+class Hop:
+    """Node of a path with its own ephemeral key and the derived symmetric key"""
+
+    __slots__ = ("node", "ephemeral_public", "key")
+
+    def __init__(self, node: Node):
+        if not node.pubkey_x25519:
+            raise OnionError(f"{node} has no x25519 public key")
+        ephemeral = nacl.public.PrivateKey.generate()
+        self.node = node
+        self.ephemeral_public = ephemeral.public_key.encode()
+        self.key = xchacha20_key(
+            ephemeral.encode(),
+            self.ephemeral_public,
+            bytes.fromhex(node.pubkey_x25519),
+        )
+
+    @property
+    def meta(self) -> Dict[str, Any]:
+        return {"ephemeral_key": self.ephemeral_public.hex(), "enc_type": ENC_TYPE}
+
+
+class OnionPath:
+    """Ordered hops with an ephemeral key each, with cached destination layers.
+
+    Separate keys keep the guard, which knows the client ip, and the destination
+    from linking a request by its ephemeral key.
+    """
+
+    def __init__(self, nodes: Sequence[Node], destination_cache_size: int = 256):
+        self.hops = tuple(Hop(node) for node in nodes)
+        self.created_at = time.monotonic()
+        self.failures = 0
+
+        self.destination_cache_size = destination_cache_size
+        self._destinations: "OrderedDict[str, Hop]" = OrderedDict()
+
+    @property
+    def guard(self) -> Node:
+        return self.hops[0].node
+
+    def destination_hop(self, node: Node) -> Hop:
+        """The layer of a destination, the last hop uses its own"""
+        for hop in self.hops:
+            if hop.node == node:
+                return hop
+
+        hop = self._destinations.get(node.pubkey_x25519)
+        if hop is None:
+            hop = self._destinations[node.pubkey_x25519] = Hop(node)
+            while len(self._destinations) > self.destination_cache_size:
+                self._destinations.popitem(last=False)
+        else:
+            self._destinations.move_to_end(node.pubkey_x25519)
+        return hop
+
+    def wrap(self, destination: Node, payload: bytes) -> Tuple[bytes, bytes]:
+        """Build the onion for the guard, returns it with the destination key"""
+        layer = self.destination_hop(destination)
+        key = layer.key
+        ciphertext = encrypt(key, payload)
+
+        # Every hop finds the blob of the next layer with that layer's key
+        relays = [hop for hop in self.hops if hop.node != destination]
+        for hop in reversed(relays):
+            routing = dict(layer.meta, destination=layer.node.pubkey_ed25519)
+            ciphertext = encrypt(hop.key, encode_blob(ciphertext, routing))
+            layer = hop
+
+        return encode_blob(ciphertext, layer.meta), key
+
+    def __contains__(self, node: Node) -> bool:
+        return any(hop.node == node for hop in self.hops)
+
+
+class OnionPathPool:
+    """Pool of pre-built onion paths over the known service nodes.
+
+    Paths are health checked when they are built, replaced after `max_failures`
+    failed requests and rotated after `path_ttl` seconds.
+    """
+
+    def __init__(
+        self,
+        swarm,
+        path_count: int = 2,
+        hop_count: int = 3,
+        path_ttl: float = 600,
+        max_failures: int = 2,
+        health_check: bool = True,
+        scheme: str = "https",
+        client: Optional[Client] = None,
+    ):
+        self.swarm = swarm
+        self.path_count = path_count
+        self.hop_count = hop_count
+        self.path_ttl = path_ttl
+        self.max_failures = max_failures
+        self.health_check = health_check
+        self.scheme = scheme
+        self.client = client
+
+        self.paths: List[OnionPath] = []
+        self._build_lock = asyncio.Lock()
+
+    def onion_url(self, node: Node) -> str:
+        return f"{self.scheme}://{node.ip}:{node.port}/onion_req/v2"
+
+    async def _nodes(self) -> List[Node]:
+        snapshot = await self.swarm.node_registry.ensure_loaded()
+        return [
+            node
+            for node in snapshot.nodes.values()
+            if node.pubkey_x25519 and node.pubkey_ed25519
+        ]
+
+    def resolve(self, url: str) -> Node:
+        """Find the node behind a storage url"""
+        parts = urlsplit(url)
+        node = self.swarm.node_registry.snapshot.get(parts.hostname, parts.port)
+        if node is not None:
+            return node
+
+        for nodes in self.swarm.swarm_map.values():
+            for node in nodes:
+                if node.url == url:
+                    return node
+        raise OnionError(f"Unknown node {url}")
+
+    def healthy(self, path: OnionPath) -> bool:
+        return (
+            path.failures < self.max_failures
+            and time.monotonic() - path.created_at < self.path_ttl
+        )
+
+    async def build_path(self, exclude: Sequence[Node] = ()) -> OnionPath:
+        nodes = [node for node in await self._nodes() if node not in exclude]
+        if len(nodes) < self.hop_count:
+            raise OnionError("Not enough service nodes to build an onion path")
+
+        path = OnionPath(random.sample(nodes, self.hop_count))
+        if self.health_check:
+            await self._send(path, path.hops[-1].node, "info", {})
+        return path
+
+    async def get_path(self, destination: Optional[Node] = None) -> OnionPath:
+        """Pick a healthy path that does not route through the destination"""
+        self.paths = [path for path in self.paths if self.healthy(path)]
+        usable = self._usable(destination)
+        if usable:
+            return random.choice(usable)
+
+        async with self._build_lock:
+            usable = self._usable(destination)
+            exclude = [destination] if destination is not None else []
+            while not usable or len(self.paths) < self.path_count:
+                path = await self.build_path(exclude)
+                self.paths.append(path)
+                usable.append(path)
+        return random.choice(usable)
+
+    def _usable(self, destination: Optional[Node]) -> List[OnionPath]:
+        # The destination may only be the last hop of a path
+        return [
+            path
+            for path in self.paths
+            if destination is None
+            or all(hop.node != destination for hop in path.hops[:-1])
+        ]
+
+    def mark_failure(self, path: OnionPath):
+        path.failures += 1
+        if not self.healthy(path) and path in self.paths:
+            self.paths.remove(path)
+
+    async def _send(
+        self, path: OnionPath, destination: Node, method: str, params: Dict[str, Any]
+    ):
+        payload = json.dumps({"method": method, "params": params}).encode()
+        onion, key = path.wrap(destination, payload)
+
+        response = await request_bytes(
+            self.onion_url(path.guard), client=self.client, data=onion, ssl=False
+        )
+        try:
+            result = json.loads(decrypt(key, response))
+        except Exception as e:
+            raise OnionError("Could not decrypt onion response") from e
+
+        if isinstance(result, dict) and "status" in result and "body" in result:
+            if result["status"] != 200:
+                raise OnionError(f"Destination answered with {result['status']}")
+            body = result["body"]
+            result = json.loads(body) if isinstance(body, str) else body
+        return result
+
+    async def request(
+        self, destination: Node, method: str, params: Dict[str, Any]
+    ) -> Any:
+        """Send a request to the destination through one of the paths"""
+        path = await self.get_path(destination)
+        try:
+            return await self._send(path, destination, method, params)
+        except Exception:
+            self.mark_failure(path)
+            raise
+
+    async def request_jsonrpc(
+        self, destination: Union[Node, str], method: str, params: Dict[str, Any]
+    ) -> Any:
+        if isinstance(destination, str):
+            await self.swarm.node_registry.ensure_loaded()
+            destination = self.resolve(destination)
+        return await self.request(destination, method, params)
@@ -0,0 +1,172 @@
+"""Registry of active service nodes that is kept in sync in the background"""
+
+import asyncio
+import time
+from types import MappingProxyType
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+from .node import Node, NodeKey
+
+# Fetch callback: receives the last known block hash and returns the rpc result
+FetchCallback = Callable[[Optional[str]], Awaitable[Dict[str, Any]]]
+
+
+class NodeSnapshot(NamedTuple):
+    """Immutable view of the service node list at a certain version"""
+
+    version: int
+    block_hash: Optional[str]
+    updated_at: float
+    nodes: Mapping[NodeKey, Node]
+    by_pubkey: Mapping[str, Node]
+    by_swarm: Mapping[int, Tuple[Node, ...]]
+    urls: Tuple[str, ...]
+
+    def get(self, ip: str, port: int) -> Optional[Node]:
+        return self.nodes.get((ip, port))
+
+    def swarm(self, swarm_id: int) -> Tuple[Node, ...]:
+        return self.by_swarm.get(swarm_id, ())
+
+
+EMPTY_SNAPSHOT = NodeSnapshot(
+    0, None, 0.0, MappingProxyType({}), MappingProxyType({}), MappingProxyType({}), ()
+)
+
+
+def build_snapshot(
+    version: int, block_hash: Optional[str], nodes: Dict[NodeKey, Node]
+) -> NodeSnapshot:
+    """Index the nodes by ed25519 public key and by swarm id"""
+    by_pubkey = {}
+    by_swarm: Dict[int, list] = {}
+    for node in nodes.values():
+        if node.pubkey_ed25519:
+            by_pubkey[node.pubkey_ed25519] = node
+        if node.swarm_id is not None:
+            by_swarm.setdefault(node.swarm_id, []).append(node)
+
+    return NodeSnapshot(
+        version=version,
+        block_hash=block_hash,
+        updated_at=time.time(),
+        nodes=MappingProxyType(nodes),
+        by_pubkey=MappingProxyType(by_pubkey),
+        by_swarm=MappingProxyType({k: tuple(v) for k, v in by_swarm.items()}),
+        urls=tuple(node.url for node in nodes.values()),
+    )
+
+
+class NodeRegistry:
+    """Loads the service node list once and applies changes in the background.
+
+    The last known block hash is passed to `fetch` so the node can answer with
+    `unchanged` instead of the full list when nothing happened on chain.
+    Readers only ever see complete snapshots and never wait on the network.
+    """
+
+    def __init__(self, fetch: FetchCallback, refresh_interval: float = 300):
+        self.fetch = fetch
+        self.refresh_interval = refresh_interval
+        self.snapshot = EMPTY_SNAPSHOT
+        # Restored snapshots are served but revalidated right away
+        self.stale = False
+
+        self._load_lock = asyncio.Lock()
+        self._sync_task: Optional[asyncio.Task] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.snapshot.version > 0
+
+    async def ensure_loaded(self) -> NodeSnapshot:
+        """Return the current snapshot, loading the full list the first time"""
+        if not self.loaded:
+            async with self._load_lock:
+                if not self.loaded:
+                    await self.refresh()
+
+        if self._sync_task is None or self._sync_task.done():
+            self._sync_task = asyncio.ensure_future(self._sync())
+
+        return self.snapshot
+
+    def restore(self, nodes: Iterable[Node], block_hash: Optional[str] = None):
+        """Serve a previously saved node list until it is revalidated"""
+        nodes = {node.key: node for node in nodes if node.valid}
+        if nodes:
+            self.snapshot = build_snapshot(1, block_hash, nodes)
+            self.stale = True
+
+    async def refresh(self) -> NodeSnapshot:
+        """Fetch the node list and apply the changes to a new snapshot"""
+        result = await self.fetch(self.snapshot.block_hash)
+        self.stale = False
+        return self.apply(result)
+
+    def apply(self, result: Dict[str, Any]) -> NodeSnapshot:
+        """Apply a `get_service_nodes` result, only bumping the version on changes"""
+        current = self.snapshot
+        if result.get("unchanged"):
+            self.snapshot = current._replace(updated_at=time.time())
+            return self.snapshot
+
+        received = {}
+        for state in result.get("service_node_states", []):
+            node = state if isinstance(state, Node) else Node.from_dict(state)
+            if node.valid:
+                received[node.key] = node
+
+        removed = current.nodes.keys() - received.keys()
+        added = received.keys() - current.nodes.keys()
+
+        # Nodes that moved to another swarm or changed keys are replaced
+        for key in received.keys() & current.nodes.keys():
+            old, new = current.nodes[key], received[key]
+            if (old.swarm_id, old.pubkey_ed25519) != (new.swarm_id, new.pubkey_ed25519):
+                removed.add(key)
+                added.add(key)
+
+        if not removed and not added and current.version:
+            self.snapshot = current._replace(
+                block_hash=result.get("block_hash"), updated_at=time.time()
+            )
+            return self.snapshot
+
+        # Keep the existing records and only touch the difference
+        nodes = {key: node for key, node in current.nodes.items() if key not in removed}
+        for key in added:
+            nodes[key] = received[key]
+
+        self.snapshot = build_snapshot(
+            current.version + 1, result.get("block_hash"), nodes
+        )
+        return self.snapshot
+
+    async def _sync(self):
+        while True:
+            if not self.stale:
+                await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception:
+                # Keep the last snapshot and try again later
+                if self.stale:
+                    await asyncio.sleep(self.refresh_interval)
+
+    async def close(self):
+        """Stop syncing in the background"""
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            await asyncio.gather(self._sync_task, return_exceptions=True)
+            self._sync_task = None
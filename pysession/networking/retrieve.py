@@ -0,0 +1,167 @@
+"""Poll the swarms of many public keys for new messages"""
+
+import asyncio
+import base64
+import heapq
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from .swarm import Swarm
+
+
+class Message(NamedTuple):
+    public_key: str
+    hash: str
+    expiration: int
+    data: bytes
+
+
+class MessagePoller:
+    """Retrieves new messages for many public keys with a fixed number of workers.
+
+    Every public key has a cursor with the hash of the last retrieved message, so
+    each poll only returns new messages. Accounts without new messages are polled
+    less often, up to `max_interval` seconds. Messages are yielded by iterating
+    over the poller with `async for`.
+    """
+
+    def __init__(
+        self,
+        swarm: Swarm,
+        concurrency: int = 32,
+        min_interval: float = 2,
+        max_interval: float = 60,
+        backoff: float = 2,
+        queue_size: int = 1024,
+    ):
+        self.swarm = swarm
+        self.concurrency = concurrency
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+
+        self.cursors: Dict[str, str] = {}
+        self.intervals: Dict[str, float] = {}
+
+        # (due time, public key), entries are only valid when they match `_due`
+        self._schedule: List[Tuple[float, str]] = []
+        self._due: Dict[str, float] = {}
+        self._changed = asyncio.Event()
+        self._messages: asyncio.Queue = asyncio.Queue(queue_size)
+        self._workers: List[asyncio.Task] = []
+
+    def add(self, public_key: str, last_hash: str = ""):
+        """Start polling a public key, optionally from a known message hash"""
+        self.cursors.setdefault(public_key, last_hash)
+        self.intervals[public_key] = self.min_interval
+        self._plan(public_key, time.monotonic())
+
+    def remove(self, public_key: str):
+        self.cursors.pop(public_key, None)
+        self.intervals.pop(public_key, None)
+        self._due.pop(public_key, None)
+
+    def _plan(self, public_key: str, due: float):
+        self._due[public_key] = due
+        heapq.heappush(self._schedule, (due, public_key))
+        self._changed.set()
+
+    async def _next_due(self) -> str:
+        while True:
+            timeout = None
+            while self._schedule:
+                due, public_key = self._schedule[0]
+                if self._due.get(public_key) != due:
+                    # Removed or rescheduled
+                    heapq.heappop(self._schedule)
+                    continue
+
+                timeout = due - time.monotonic()
+                if timeout <= 0:
+                    heapq.heappop(self._schedule)
+                    del self._due[public_key]
+                    return public_key
+                break
+
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def poll(self, public_key: str) -> List[Message]:
+        """Retrieve the messages after the cursor of a public key"""
+        url = await self.swarm.get_swarm_node_url(public_key)
+        result = await self.swarm.ask_public_key(
+            url, "retrieve", public_key, {"lastHash": self.cursors.get(public_key, "")}
+        )
+        result = result.get("result", result)
+
+        messages = [
+            Message(
+                public_key,
+                message["hash"],
+                message.get("expiration", 0),
+                base64.b64decode(message.get("data", "")),
+            )
+            for message in result.get("messages", [])
+        ]
+        if messages and public_key in self.cursors:
+            self.cursors[public_key] = messages[-1].hash
+        return messages
+
+    async def _worker(self):
+        while True:
+            public_key = await self._next_due()
+            try:
+                messages = await self.poll(public_key)
+            except Exception:
+                # Try again later, the node selector takes care of bad nodes
+                messages = []
+
+            for message in messages:
+                await self._messages.put(message)
+
+            if public_key not in self.intervals:
+                continue
+
+            # Back off for accounts that stay idle
+            if messages:
+                interval = self.min_interval
+            else:
+                interval = min(
+                    self.intervals[public_key] * self.backoff, self.max_interval
+                )
+            self.intervals[public_key] = interval
+            self._plan(public_key, time.monotonic() + interval)
+
+    def start(self):
+        if not self._workers:
+            self._workers = [
+                asyncio.ensure_future(self._worker()) for _ in range(self.concurrency)
+            ]
+
+    async def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def get(self, timeout: Optional[float] = None) -> Message:
+        """Wait for the next message"""
+        self.start()
+        return await asyncio.wait_for(self._messages.get(), timeout)
+
+    def __aiter__(self):
+        self.start()
+        return self
+
+    async def __anext__(self) -> Message:
+        return await self._messages.get()
+
+    async def __aenter__(self) -> "MessagePoller":
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
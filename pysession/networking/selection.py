@@ -0,0 +1,126 @@
+"""Strategies for picking the storage node to send a request to"""
+
+import random
+import time
+from collections import deque
+from typing import Dict, Optional, Sequence
+
+
+class NodeStats:
+    """Moving averages of the latency and error rate of a single node"""
+
+    __slots__ = ("latency", "error_rate", "failures", "cooldown_until")
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.error_rate = 0.0
+        self.failures = 0
+        self.cooldown_until = 0.0
+
+
+class NodeSelector:
+    """Picks nodes at random and keeps track of how they perform.
+
+    Subclasses override `choose` to prefer healthy nodes. Nodes that fail
+    `max_failures` times in a row are skipped for `cooldown` seconds.
+    """
+
+    def __init__(
+        self,
+        alpha: float = 0.2,
+        initial_latency: float = 0.5,
+        max_failures: int = 3,
+        cooldown: float = 60,
+    ):
+        self.alpha = alpha
+        self.initial_latency = initial_latency
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.stats: Dict[str, NodeStats] = {}
+
+        # Latencies of the most recent requests over all nodes
+        self.recent: deque = deque(maxlen=256)
+
+    def _stats(self, url: str) -> NodeStats:
+        stats = self.stats.get(url)
+        if stats is None:
+            stats = self.stats[url] = NodeStats(self.initial_latency)
+        return stats
+
+    def available(self, url: str, now: Optional[float] = None) -> bool:
+        stats = self.stats.get(url)
+        return stats is None or stats.cooldown_until <= (now or time.monotonic())
+
+    def candidates(self, urls: Sequence[str]) -> Sequence[str]:
+        """Nodes that are not cooling down, or all nodes if every node is"""
+        now = time.monotonic()
+        available = [url for url in urls if self.available(url, now)]
+        return available or urls
+
+    def choose(self, urls: Sequence[str]) -> str:
+        if not urls:
+            raise ValueError("No nodes to choose from")
+        return random.choice(self.candidates(urls))
+
+    def report_success(self, url: str, latency: float):
+        stats = self._stats(url)
+        stats.latency += self.alpha * (latency - stats.latency)
+        stats.error_rate -= self.alpha * stats.error_rate
+        stats.failures = 0
+        self.recent.append(latency)
+
+    def latency_percentile(self, percentile: float) -> float:
+        """Latency below which `percentile` percent of the recent requests finished"""
+        if not self.recent:
+            return self.initial_latency
+        ordered = sorted(self.recent)
+        index = min(len(ordered) - 1, int(len(ordered) * percentile / 100))
+        return ordered[index]
+
+    def report_failure(self, url: str):
+        stats = self._stats(url)
+        stats.error_rate += self.alpha * (1 - stats.error_rate)
+        stats.failures += 1
+
+        # Circuit breaker
+        if stats.failures >= self.max_failures:
+            stats.cooldown_until = time.monotonic() + self.cooldown
+            stats.failures = 0
+
+    def score(self, url: str) -> float:
+        """Expected cost of a request, lower is better"""
+        stats = self.stats.get(url)
+        if stats is None:
+            return self.initial_latency
+        return stats.latency * (1 + 4 * stats.error_rate)
+
+
+class PowerOfTwoSelector(NodeSelector):
+    """Picks two random nodes and uses the one with the lowest score.
+
+    This avoids degraded nodes while keeping the choice random, so requests for
+    a public key are not always sent to the same node.
+    """
+
+    def choose(self, urls: Sequence[str]) -> str:
+        if not urls:
+            raise ValueError("No nodes to choose from")
+
+        candidates = self.candidates(urls)
+        if len(candidates) == 1:
+            return candidates[0]
+
+        first, second = random.sample(candidates, 2)
+        return first if self.score(first) <= self.score(second) else second
+
+
+class WeightedSelector(NodeSelector):
+    """Picks nodes with a probability inversely proportional to their score"""
+
+    def choose(self, urls: Sequence[str]) -> str:
+        if not urls:
+            raise ValueError("No nodes to choose from")
+
+        candidates = list(self.candidates(urls))
+        weights = [1 / max(self.score(url), 1e-3) for url in candidates]
+        return random.choices(candidates, weights)[0]
@@ -0,0 +1,164 @@
+"""Queue for storing messages in the swarms of their recipients"""
+
+import asyncio
+import base64
+import time
+from typing import Dict, List, NamedTuple, Optional, Set
+
+from .node import Node
+from .swarm import Swarm
+from .util import JsonRpcBatch
+
+
+class OutgoingMessage(NamedTuple):
+    public_key: str
+    params: dict
+    future: asyncio.Future
+
+
+class MessageSender:
+    """Stores messages in batches per storage node.
+
+    `send` waits while `max_pending` messages are undelivered, which keeps memory
+    usage bounded during bursts. Messages for the same node are collected for
+    `linger` seconds and sent as one jsonrpc batch of up to `batch_size` calls,
+    with at most `node_concurrency` batches in flight per node.
+    """
+
+    def __init__(
+        self,
+        swarm: Swarm,
+        max_pending: int = 1024,
+        batch_size: int = 32,
+        node_concurrency: int = 2,
+        linger: float = 0.005,
+        ttl: int = 24 * 60 * 60 * 1000,
+    ):
+        self.swarm = swarm
+        self.batch_size = batch_size
+        self.node_concurrency = node_concurrency
+        self.linger = linger
+        self.ttl = ttl
+
+        self._pending = asyncio.Semaphore(max_pending)
+        self._queues: Dict[str, List[OutgoingMessage]] = {}
+        self._node_slots: Dict[str, asyncio.Semaphore] = {}
+        self._flushers: Set[asyncio.Task] = set()
+
+    async def send(
+        self,
+        public_key: str,
+        data: bytes,
+        ttl: Optional[int] = None,
+        timestamp: Optional[int] = None,
+    ) -> asyncio.Future:
+        """Queue a message and return a future with the response of the node"""
+        await self._pending.acquire()
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(lambda _: self._pending.release())
+
+        params = {
+            "pubKey": public_key,
+            "data": base64.b64encode(data).decode("ascii"),
+            "ttl": str(ttl or self.ttl),
+            "timestamp": str(timestamp or int(time.time() * 1000)),
+        }
+
+        try:
+            url = await self.swarm.get_swarm_node_url(public_key)
+        except Exception as e:
+            future.set_exception(e)
+            return future
+
+        queue = self._queues.setdefault(url, [])
+        queue.append(OutgoingMessage(public_key, params, future))
+
+        # The first message for a node starts the flush of its queue
+        if len(queue) == 1:
+            flusher = asyncio.ensure_future(self._flush(url))
+            self._flushers.add(flusher)
+            flusher.add_done_callback(self._flushers.discard)
+
+        return future
+
+    async def _flush(self, url: str):
+        await asyncio.sleep(self.linger)
+        queue = self._queues.pop(url, [])
+
+        slots = self._node_slots.get(url)
+        if slots is None:
+            slots = self._node_slots[url] = asyncio.Semaphore(self.node_concurrency)
+
+        await asyncio.gather(
+            *(
+                self._send_batch(url, slots, queue[i : i + self.batch_size])
+                for i in range(0, len(queue), self.batch_size)
+            )
+        )
+
+    async def _send_batch(
+        self, url: str, slots: asyncio.Semaphore, messages: List[OutgoingMessage]
+    ):
+        async with slots:
+            batch = JsonRpcBatch(url, ignore_self_signed=True)
+            futures = [batch.add("store", message.params) for message in messages]
+
+            start = time.monotonic()
+            try:
+                await batch.send()
+            except Exception as e:
+                self.swarm.selector.report_failure(url)
+                for message in messages:
+                    if not message.future.done():
+                        message.future.set_exception(e)
+                return
+            results = await asyncio.gather(*futures, return_exceptions=True)
+
+        if all(isinstance(result, Exception) for result in results):
+            self.swarm.selector.report_failure(url)
+        else:
+            self.swarm.selector.report_success(url, time.monotonic() - start)
+
+        for message, result in zip(messages, results):
+            if message.future.done():
+                continue
+            if isinstance(result, Exception):
+                message.future.set_exception(result)
+            elif "snodes" in result:
+                # The swarm changed, resend through the new swarm
+                self.swarm.swarm_map.set(
+                    message.public_key,
+                    tuple(Node.from_dict(node) for node in result["snodes"]),
+                )
+                self._retry(message)
+            else:
+                message.future.set_result(result)
+
+    def _retry(self, message: OutgoingMessage):
+        async def retry():
+            try:
+                url = await self.swarm.get_swarm_node_url(message.public_key)
+                result = await self.swarm.ask_public_key(
+                    url, "store", message.public_key, message.params
+                )
+            except Exception as e:
+                if not message.future.done():
+                    message.future.set_exception(e)
+                return
+            if not message.future.done():
+                message.future.set_result(result)
+
+        task = asyncio.ensure_future(retry())
+        self._flushers.add(task)
+        task.add_done_callback(self._flushers.discard)
+
+    async def close(self):
+        """Wait until all queued messages are delivered"""
+        while self._flushers:
+            await asyncio.gather(*self._flushers, return_exceptions=True)
+
+    async def __aenter__(self) -> "MessageSender":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
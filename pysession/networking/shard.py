@@ -0,0 +1,266 @@
+"""Spread many identities over worker processes.
+
+Public keys are assigned to workers with a consistent hash ring, so when a worker
+exits only its own keys move to the others. All workers share the service node
+list and swarms through a `SharedStore`.
+"""
+
+import asyncio
+import bisect
+import hashlib
+import multiprocessing
+import os
+import tempfile
+from multiprocessing.connection import wait
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from .shared import SharedStore
+from .swarm import Swarm
+from .util import close_client
+
+# Called with the added and the removed public keys of a shard
+ChangeCallback = Callable[[Set[str], Set[str]], None]
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(value.encode(), digest_size=8).digest(), "big"
+    )
+
+
+class HashRing:
+    """Consistent hash ring with `replicas` virtual points per member"""
+
+    def __init__(self, members: Iterable[int] = (), replicas: int = 100):
+        self.replicas = replicas
+        self._points: List[Tuple[int, int]] = []
+        for member in members:
+            self.add(member)
+
+    @property
+    def members(self) -> Set[int]:
+        return {member for _, member in self._points}
+
+    def add(self, member: int):
+        for replica in range(self.replicas):
+            bisect.insort(self._points, (_hash(f"{member}:{replica}"), member))
+
+    def remove(self, member: int):
+        self._points = [point for point in self._points if point[1] != member]
+
+    def owner(self, key: str) -> int:
+        if not self._points:
+            raise LookupError("The hash ring is empty")
+        index = bisect.bisect(self._points, (_hash(key), -1)) % len(self._points)
+        return self._points[index][1]
+
+    def assign(self, keys: Iterable[str]) -> Dict[int, Set[str]]:
+        assignment: Dict[int, Set[str]] = {member: set() for member in self.members}
+        for key in keys:
+            assignment[self.owner(key)].add(key)
+        return assignment
+
+
+class Shard:
+    """Public keys and swarm of a single worker, passed to the target"""
+
+    def __init__(self, worker_id: int, public_keys: Set[str], swarm: Swarm):
+        self.worker_id = worker_id
+        self.public_keys = public_keys
+        self.swarm = swarm
+        self._callbacks: List[ChangeCallback] = []
+
+    def on_change(self, callback: ChangeCallback):
+        """Call back when the supervisor moves keys to or from this shard"""
+        self._callbacks.append(callback)
+
+    def _apply(self, added: Set[str], removed: Set[str]):
+        self.public_keys |= added
+        self.public_keys -= removed
+        for callback in self._callbacks:
+            callback(added, removed)
+
+
+Target = Callable[[Shard], Awaitable[Any]]
+
+
+async def _run_worker(target: Target, worker_id, public_keys, path, lock, control):
+    store = SharedStore.attach(path, lock)
+    swarm = Swarm()
+    swarm.shared = store
+    shard = Shard(worker_id, set(public_keys), swarm)
+
+    async def listen():
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await loop.run_in_executor(None, control.get)
+            if message is None:
+                return
+            shard._apply(*message)
+
+    work = asyncio.ensure_future(target(shard))
+    listener = asyncio.ensure_future(listen())
+    try:
+        await asyncio.wait({work, listener}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        # Unblock the thread that waits for control messages
+        control.put(None)
+        for task in (work, listener):
+            task.cancel()
+        await asyncio.gather(listener, return_exceptions=True)
+        await swarm.close()
+        await close_client()
+        store.close()
+
+    if work.done() and not work.cancelled():
+        work.result()
+
+
+def _worker_main(target: Target, worker_id, public_keys, path, lock, control):
+    asyncio.run(_run_worker(target, worker_id, public_keys, path, lock, control))
+
+
+class ShardedRunner:
+    """Runs `target(shard)` in `workers` processes and rebalances on exits.
+
+    Keys of a worker that exits are handed to the remaining workers. Workers that
+    fail are restarted with their keys when `restart` is set. `target` has to be
+    picklable, like a module level coroutine function.
+    """
+
+    def __init__(
+        self,
+        target: Target,
+        public_keys: Iterable[str],
+        workers: Optional[int] = None,
+        restart: bool = False,
+        replicas: int = 100,
+        store_path: Optional[str] = None,
+        store_slots: int = 1 << 16,
+        context: Optional[Any] = None,
+    ):
+        self.target = target
+        self.public_keys = set(public_keys)
+        self.worker_count = workers or os.cpu_count() or 1
+        self.restart = restart
+        self.context = context or multiprocessing.get_context("spawn")
+
+        self.ring = HashRing(range(self.worker_count), replicas)
+        self.assignment = self.ring.assign(self.public_keys)
+        self.processes: Dict[int, Any] = {}
+        self.controls: Dict[int, Any] = {}
+        self.exit_codes: Dict[int, List[int]] = {}
+        self.stopping = False
+
+        self._own_store = store_path is None
+        if store_path is None:
+            directory = "/dev/shm" if os.path.isdir("/dev/shm") else None
+            handle, store_path = tempfile.mkstemp(prefix="pysession-", dir=directory)
+            os.close(handle)
+        self.lock = self.context.Lock()
+        self.store = SharedStore.create(store_path, self.lock, slots=store_slots)
+
+    def _spawn(self, worker_id: int):
+        control = self.context.Queue()
+        process = self.context.Process(
+            target=_worker_main,
+            args=(
+                self.target,
+                worker_id,
+                sorted(self.assignment[worker_id]),
+                self.store.path,
+                self.lock,
+                control,
+            ),
+            name=f"pysession-shard-{worker_id}",
+            daemon=True,
+        )
+        process.start()
+        self.processes[worker_id] = process
+        self.controls[worker_id] = control
+
+    def start(self):
+        for worker_id in sorted(self.ring.members):
+            self._spawn(worker_id)
+
+    def _exited(self, worker_id: int):
+        process = self.processes.pop(worker_id)
+        self.controls.pop(worker_id).close()
+        self.exit_codes.setdefault(worker_id, []).append(process.exitcode)
+
+        if self.stopping:
+            return
+        if self.restart and process.exitcode != 0:
+            self._spawn(worker_id)
+            return
+
+        self.ring.remove(worker_id)
+        if self.ring.members:
+            self.rebalance()
+
+    def rebalance(self):
+        """Move keys to their owner on the ring and notify the running workers"""
+        assignment = self.ring.assign(self.public_keys)
+        for worker_id, keys in assignment.items():
+            old = self.assignment.get(worker_id, set())
+            added, removed = keys - old, old - keys
+            if (added or removed) and worker_id in self.controls:
+                self.controls[worker_id].put((added, removed))
+        self.assignment = assignment
+
+    def supervise(self, timeout: Optional[float] = None) -> bool:
+        """Handle exited workers, returns False when none are left"""
+        if not self.processes:
+            return False
+        sentinels = {
+            process.sentinel: worker_id for worker_id, process in self.processes.items()
+        }
+        for sentinel in wait(list(sentinels), timeout):
+            worker_id = sentinels[sentinel]
+            self.processes[worker_id].join()
+            self._exited(worker_id)
+        return bool(self.processes)
+
+    def run(self):
+        """Start the workers and supervise them until all of them exited"""
+        self.start()
+        try:
+            while self.supervise():
+                pass
+        finally:
+            self.stop()
+
+    def stop(self, timeout: float = 5):
+        """Ask all workers to stop and remove the shared store"""
+        if self.stopping:
+            return
+        self.stopping = True
+        for control in self.controls.values():
+            control.put(None)
+        for worker_id, process in list(self.processes.items()):
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+            self._exited(worker_id)
+
+        self.store.close()
+        if self._own_store and os.path.exists(self.store.path):
+            os.unlink(self.store.path)
+
+    def __enter__(self) -> "ShardedRunner":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
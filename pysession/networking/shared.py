@@ -0,0 +1,180 @@
+"""Service node list and swarm map shared between processes.
+
+The store is a memory mapped file with a fixed layout:
+
+    header | node list (json) | swarm table
+
+The node list is written once by whichever process fetched it and read by the
+others, which decode it into `Node` records once per version. The swarm table
+maps public keys to swarm ids in fixed size slots with linear probing, so a swarm
+is only fetched by one process and resolved by the others through their node
+list.
+"""
+
+import json
+import mmap
+import os
+import struct
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from .decode import decode_nodes
+from .node import Node
+
+MAGIC = b"PYSS0001"
+
+# magic, slot count, node list capacity, node list version, length and update time
+HEADER = struct.Struct("<8sQQQQd")
+HEADER_SIZE = 64
+
+# public key, swarm id, update time
+SLOT = struct.Struct("<33s7xQd")
+EMPTY_KEY = bytes(33)
+
+# Slots that are checked before the oldest one is overwritten
+MAX_PROBES = 16
+
+
+class SharedStoreError(Exception):
+    pass
+
+
+class SharedStore:
+    """Memory mapped store, writes are serialised with a multiprocessing lock"""
+
+    def __init__(self, path: str, lock, fileno: int, size: int):
+        self.path = path
+        self.lock = lock
+        self._file = fileno
+        self._map = mmap.mmap(fileno, size)
+
+        magic, self.slots, self.nodes_capacity, _, _, _ = HEADER.unpack_from(
+            self._map, 0
+        )
+        if magic != MAGIC:
+            raise SharedStoreError(f"{path} is not a shared store")
+        self._table = HEADER_SIZE + self.nodes_capacity
+
+        # Decoded node list of this process: (version, result)
+        self._nodes: Tuple[int, Optional[Dict[str, Any]]] = (0, None)
+
+    @classmethod
+    def create(
+        cls, path: str, lock, slots: int = 1 << 16, nodes_capacity: int = 8 << 20
+    ) -> "SharedStore":
+        size = HEADER_SIZE + nodes_capacity + slots * SLOT.size
+        fileno = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.ftruncate(fileno, size)
+        os.pwrite(fileno, HEADER.pack(MAGIC, slots, nodes_capacity, 0, 0, 0.0), 0)
+        return cls(path, lock, fileno, size)
+
+    @classmethod
+    def attach(cls, path: str, lock) -> "SharedStore":
+        fileno = os.open(path, os.O_RDWR)
+        return cls(path, lock, fileno, os.fstat(fileno).st_size)
+
+    def close(self):
+        self._map.close()
+        os.close(self._file)
+
+    def _header(self) -> Tuple[int, int, float]:
+        """Version, length and update time of the node list"""
+        return HEADER.unpack_from(self._map, 0)[3:]
+
+    def _write_header(self, version: int, length: int, updated_at: float):
+        HEADER.pack_into(
+            self._map,
+            0,
+            MAGIC,
+            self.slots,
+            self.nodes_capacity,
+            version,
+            length,
+            updated_at,
+        )
+
+    @property
+    def nodes_version(self) -> int:
+        return self._header()[0]
+
+    def publish_nodes(self, result: Dict[str, Any]):
+        """Store a `get_service_nodes` result for all processes"""
+        states = [
+            state.to_dict() if isinstance(state, Node) else state
+            for state in result.get("service_node_states", [])
+        ]
+        data = json.dumps(
+            {"service_node_states": states, "block_hash": result.get("block_hash")},
+            separators=(",", ":"),
+        ).encode()
+        if len(data) > self.nodes_capacity:
+            raise SharedStoreError("Node list does not fit in the shared store")
+
+        with self.lock:
+            version = self._header()[0] + 1
+            self._map[HEADER_SIZE : HEADER_SIZE + len(data)] = data
+            self._write_header(version, len(data), time.time())
+
+    def touch_nodes(self):
+        """Mark the node list as up to date without changing it"""
+        with self.lock:
+            version, length, _ = self._header()
+            if version:
+                self._write_header(version, length, time.time())
+
+    def read_nodes(self, max_age: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """The shared node list, or None when there is none younger than max_age"""
+        version, length, updated_at = self._header()
+        if not version or (max_age is not None and time.time() - updated_at > max_age):
+            return None
+        if self._nodes[0] == version:
+            return self._nodes[1]
+
+        with self.lock:
+            version, length, _ = self._header()
+            data = self._map[HEADER_SIZE : HEADER_SIZE + length]
+        result = decode_nodes(data)
+        self._nodes = (version, result)
+        return result
+
+    @staticmethod
+    def _key(public_key: str) -> bytes:
+        key = bytes.fromhex(public_key)
+        if len(key) != 33:
+            raise SharedStoreError(f"Invalid public key {public_key}")
+        return key
+
+    def _probe(self, key: bytes):
+        start = int.from_bytes(key[1:9], "little") % self.slots
+        for step in range(min(MAX_PROBES, self.slots)):
+            offset = self._table + (start + step) % self.slots * SLOT.size
+            yield offset, SLOT.unpack_from(self._map, offset)
+
+    def set_swarm(self, public_key: str, swarm_id: int):
+        key = self._key(public_key)
+        with self.lock:
+            target, oldest = None, None
+            for offset, (slot_key, _, updated_at) in self._probe(key):
+                if slot_key == key or slot_key == EMPTY_KEY:
+                    target = offset
+                    break
+                if oldest is None or updated_at < oldest[1]:
+                    oldest = (offset, updated_at)
+            if target is None:
+                # The table is a cache, replace the oldest entry nearby
+                target = oldest[0]
+            SLOT.pack_into(self._map, target, key, swarm_id, time.time())
+
+    def get_swarm(
+        self, public_key: str, max_age: Optional[float] = None
+    ) -> Optional[int]:
+        key = self._key(public_key)
+        with self.lock:
+            for _, (slot_key, swarm_id, updated_at) in self._probe(key):
+                if slot_key == EMPTY_KEY:
+                    return None
+                if slot_key == key:
+                    if max_age is not None and time.time() - updated_at > max_age:
+                        return None
+                    return swarm_id
+        return None
@@ -0,0 +1,54 @@
+"""Save and restore the known nodes and swarms between runs"""
+
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict
+
+SNAPSHOT_VERSION = 1
+
+
+def save_snapshot(path: str, swarm) -> Dict[str, Any]:
+    """Write the node list and swarm map of a swarm to a json file atomically"""
+    registry = swarm.node_registry.snapshot
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "saved_at": time.time(),
+        "seed_nodes": list(swarm.storage_server_seed_cache),
+        "block_hash": registry.block_hash,
+        "service_nodes": [node.to_dict() for node in registry.nodes.values()],
+        "swarms": {
+            public_key: {"age": age, "snodes": [node.to_dict() for node in swarm]}
+            for public_key, age, swarm in swarm.swarm_map.items()
+        },
+    }
+
+    # Write next to the target so the rename is atomic
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "w") as snapshot_file:
+            json.dump(snapshot, snapshot_file)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+    return snapshot
+
+
+def load_snapshot(path: str, max_age: float) -> Dict[str, Any]:
+    """Read a snapshot, returns an empty dict when it is missing, invalid or too old"""
+    try:
+        with open(path, "r") as snapshot_file:
+            snapshot = json.load(snapshot_file)
+    except (OSError, ValueError):
+        return {}
+
+    if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+        return {}
+    if time.time() - snapshot.get("saved_at", 0) > max_age:
+        return {}
+
+    return snapshot
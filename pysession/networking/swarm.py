@@ -1,25 +1,57 @@
-import os
+import asyncio
 import json
-import time
+import os
 import random
-import asyncio
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-from .util import request_jsonrpc
+from ..metrics import metrics
+from .cache import SwarmCache
+from .decode import decode_nodes
+from .node import Node
+from .registry import NodeRegistry
+from .selection import NodeSelector, PowerOfTwoSelector
+from .snapshot import load_snapshot, save_snapshot
+from .util import request_jsonrpc, retry
 
 # TODO: WORK IN PROGRESS
-# TODO: Create a node dataclass
 
 
 class SwarmException(Exception):
     pass
 
 
+class SwarmReorganised(SwarmException):
+    """The swarm of a public key kept changing while it was requested"""
+
+
 class Swarm:
-    def __init__(self):
+    def __init__(
+        self,
+        swarm_cache_size: int = 10000,
+        swarm_ttl: float = 3600,
+        max_swarm_lookups: int = 16,
+        node_refresh_interval: float = 300,
+        selector: Optional[NodeSelector] = None,
+        snapshot_path: Optional[str] = None,
+        snapshot_max_age: float = 24 * 3600,
+    ):
         # Create working variables
-        self.swarm_url_lock = asyncio.Lock()
-        self.swarm_map = {}
-        self.storage_server_seed_cache = {}
+        self.selector = selector or PowerOfTwoSelector()
+        # Set to an onion.OnionPathPool to route storage requests through paths
+        self.onion = None
+        # Set to a shared.SharedStore to share nodes and swarms between processes
+        self.shared = None
+        self.swarm_lookups: Dict[str, asyncio.Future] = {}
+        self.swarm_lookup_semaphore = asyncio.Semaphore(max_swarm_lookups)
+        self.swarm_map = SwarmCache(
+            self.lookup_swarm, max_size=swarm_cache_size, ttl=swarm_ttl
+        )
+        self.storage_server_seed_cache: List[str] = []
+        self.seed_lock = asyncio.Lock()
+        self.node_registry = NodeRegistry(
+            self.fetch_service_nodes, refresh_interval=node_refresh_interval
+        )
 
         # Load seed for the swarm
         current = os.path.dirname(os.path.abspath(__file__))
@@ -27,11 +59,44 @@ class Swarm:
         with open(node_path, "r") as node_file:
             self.seed_node_list = json.load(node_file)
 
-    async def storage_servers_from_seed(self) -> list:
-        if self.storage_server_seed_cache:
-            return self.storage_server_seed_cache
+        # Serve the nodes of a previous run while they are revalidated
+        self.snapshot_path = snapshot_path
+        if snapshot_path:
+            self.load_snapshot(snapshot_path, snapshot_max_age)
+
+    def load_snapshot(self, path: str, max_age: float = 24 * 3600) -> bool:
+        """Restore nodes and swarms saved by `save_snapshot`"""
+        snapshot = load_snapshot(path, max_age)
+        if not snapshot:
+            return False
+
+        self.storage_server_seed_cache = snapshot.get("seed_nodes", [])
+        self.node_registry.restore(
+            map(Node.from_dict, snapshot.get("service_nodes", [])),
+            snapshot.get("block_hash"),
+        )
+
+        # Keep the age so old swarms are refreshed in the background
+        elapsed = time.time() - snapshot["saved_at"]
+        for public_key, entry in snapshot.get("swarms", {}).items():
+            snodes = tuple(Node.from_dict(node) for node in entry["snodes"])
+            self.swarm_map.set(public_key, snodes, age=entry["age"] + elapsed)
+        return True
+
+    def save_snapshot(self, path: Optional[str] = None):
+        """Save the known nodes and swarms for the next run"""
+        save_snapshot(path or self.snapshot_path, self)
+
+    def seed_urls(self) -> List[str]:
+        """Json rpc urls of all seeds, by hostname and by ip"""
+        urls = []
+        for seed in self.seed_node_list:
+            urls.append(seed["url"])
+            if seed.get("ip_url"):
+                urls.append(seed["ip_url"].rstrip("/") + "/json_rpc")
+        return urls
 
-        seed = random.choice(self.seed_node_list)
+    async def ask_seed(self, url: str) -> List[str]:
         params = {
             "active_only": True,
             "limit": 5,  # Request only 5 for now.
@@ -40,106 +105,379 @@ class Swarm:
                 "storage_port": True,
             },
         }
-        response = await request_jsonrpc(seed["url"], "get_n_service_nodes", params)
-
-        storage_nodes = filter(
-            lambda x: x['public_ip'] != "0.0.0.0",
-            response["result"]["service_node_states"],
-        )
-        storage_nodes = map(
-            lambda x: f"https://{x['public_ip']}:{x['storage_port']}/storage_rpc/v1",
-            storage_nodes,
+        response = await request_jsonrpc(
+            url, "get_n_service_nodes", params, decode=decode_nodes
         )
 
-        # Cache to speed up the progress
-        self.storage_server_seed_cache = list(storage_nodes)
+        storage_nodes = response["result"]["service_node_states"]
+        urls = [node.url for node in storage_nodes if node.valid]
+        if not urls:
+            raise SwarmException(f"Seed {url} did not return any storage nodes")
+        return urls
 
-        return self.storage_server_seed_cache
+    async def storage_servers_from_seed(self) -> list:
+        if self.storage_server_seed_cache:
+            return self.storage_server_seed_cache
+
+        async with self.seed_lock:
+            if self.storage_server_seed_cache:
+                return self.storage_server_seed_cache
+
+            # Ask all seeds at once and use the first valid answer
+            urls = self.seed_urls()
+            random.shuffle(urls)
+            pending = {asyncio.ensure_future(self.ask_seed(url)) for url in urls}
+            error: Optional[BaseException] = None
+            try:
+                while pending:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        if task.exception() is None:
+                            # Cache to speed up the progress
+                            self.storage_server_seed_cache = task.result()
+                            return self.storage_server_seed_cache
+                        error = task.exception()
+            finally:
+                for task in pending:
+                    task.cancel()
+
+        raise SwarmException("None of the seeds returned storage nodes") from error
+
+    async def fetch_service_nodes(self, block_hash: Optional[str] = None) -> dict:
+        """Request the active service nodes through a storage node.
+
+        With a shared store a recent list fetched by another process is used.
+        """
+        if self.shared is not None:
+            result = self.shared.read_nodes(self.node_registry.refresh_interval)
+            if result is not None:
+                if block_hash and result.get("block_hash") == block_hash:
+                    return {"unchanged": True, "block_hash": block_hash}
+                return result
 
-    async def storage_servers_from_service_nodes(self) -> list:
         node_url = await self.random_service_node(True)
 
-        # Retrieve all service nodes
-        # NOTE: This requests all service nodes every time. needs some optimization.
         params = {
-            "active_only": True,
-            "fields": {"public_ip": True, "storage_port": True},
+            "endpoint": "get_service_nodes",
+            "params": {
+                "active_only": True,
+                "fields": {
+                    "public_ip": True,
+                    "storage_port": True,
+                    "pubkey_ed25519": True,
+                    "pubkey_x25519": True,
+                    "swarm_id": True,
+                    "block_hash": True,
+                },
+            },
         }
+        # The node answers with `unchanged` when the block did not change
+        if block_hash:
+            params["params"]["poll_block_hash"] = block_hash
 
-        response = await request_jsonrpc(
-            node_url, "oxend_request", params, options={"snode": True}
-        )
-        storage_nodes = filter(
-            lambda node: node.public_ip != "0.0.0.0",
-            response["result"]["service_node_states"],
-        )
-        storage_nodes = map(
-            lambda node: f"https://{node.public_ip}:{node.storage_port}/storage_rpc/v1",
-            storage_nodes,
+        # Paths are built from this list, so it can't be requested through them
+        response = await self.request_node(
+            node_url, "oxend_request", params, onion=False, decode=decode_nodes
         )
-        return storage_nodes
+        result = response["result"]
+        if self.shared is not None:
+            if result.get("unchanged"):
+                self.shared.touch_nodes()
+            else:
+                self.shared.publish_nodes(result)
+        return result
+
+    async def storage_servers_from_service_nodes(self) -> list:
+        snapshot = await self.node_registry.ensure_loaded()
+        return list(snapshot.urls)
 
     async def random_service_node(self, use_seed: bool = False) -> str:
-        storage_nodes = [x for nodes in self.swarm_map.snodes for x in nodes]
-        storage_nodes = map(
-            lambda node: f"https://{node.ip}:{node.port}/storage_rpc/v1", storage_nodes
-        )
+        """Pick a node of the node list, or of the seeds while none is loaded.
 
+        With `use_seed` the node list is not loaded first, which is needed to
+        fetch the list itself.
+        """
         if use_seed:
-            storage_nodes.append(await self.storage_servers_from_seed())
+            urls = self.node_registry.snapshot.urls
+            if not urls:
+                urls = await self.storage_servers_from_seed()
         else:
-            storage_nodes.append(await self.storage_servers_from_service_nodes())
+            urls = (await self.node_registry.ensure_loaded()).urls
+        return self.selector.choose(urls)
+
+    async def request_node(
+        self,
+        url: str,
+        method: str,
+        params: dict,
+        onion: bool = True,
+        decode: Optional[Callable[[bytes], Any]] = None,
+    ) -> dict:
+        """Send a jsonrpc request to a storage node and report how it went"""
+        start = time.monotonic()
+        try:
+            result = await request_jsonrpc(
+                url,
+                method,
+                params,
+                ignore_self_signed=True,
+                onion=self.onion if onion else None,
+                decode=decode,
+            )
+        except Exception as e:
+            self.selector.report_failure(url)
+            if metrics.enabled:
+                metrics.inc(
+                    "pysession_node_errors_total",
+                    node=url,
+                    method=method,
+                    error=type(e).__name__,
+                )
+            raise
 
-        # Random node without duplicates.
-        return random.choice(set(storage_nodes))
+        elapsed = time.monotonic() - start
+        self.selector.report_success(url, elapsed)
+        if metrics.enabled:
+            metrics.observe(
+                "pysession_node_request_seconds", elapsed, node=url, method=method
+            )
+        return result
+
+    async def fetch_swarm(self, public_key: str) -> Tuple[Node, ...]:
+        """Ask random nodes for the swarm of a public key until one answers"""
+        return await retry(lambda: self._fetch_swarm(public_key))
+
+    async def _fetch_swarm(self, public_key: str) -> Tuple[Node, ...]:
+        node_url = await self.random_service_node(True)
+        node_data = await self.request_node(
+            node_url,
+            "get_snodes_for_pubkey",
+            {"pubKey": public_key},
+            decode=decode_nodes,
+        )
+        if not node_data:
+            raise SwarmException(
+                f"Could not get storage nodes from {node_url} pub: {public_key}"
+            )
+        if "snodes" not in node_data:
+            raise SwarmException(
+                f"Could not get storage nodes object from {node_url}, {public_key}"
+            )
+        # Onion responses are not decoded into nodes
+        return tuple(
+            node if isinstance(node, Node) else Node.from_dict(node)
+            for node in node_data["snodes"]
+        )
+
+    async def lookup_swarm(self, public_key: str) -> Tuple[Node, ...]:
+        """Fetch and cache the swarm of a public key.
+
+        Concurrent lookups for the same public key share a single request, lookups
+        for different keys run in parallel up to `max_swarm_lookups`.
+        """
+        lookup = self.swarm_lookups.get(public_key)
+        if metrics.enabled:
+            shared = "true" if lookup is not None else "false"
+            metrics.inc("pysession_swarm_lookups_total", shared=shared)
+        if lookup is None:
+            lookup = asyncio.ensure_future(self._lookup_swarm(public_key))
+            self.swarm_lookups[public_key] = lookup
+            lookup.add_done_callback(lambda _: self.swarm_lookups.pop(public_key, None))
+
+        # Shield so a cancelled caller does not cancel the lookup of the others
+        return await asyncio.shield(lookup)
+
+    async def _lookup_swarm(self, public_key: str) -> Tuple[Node, ...]:
+        snodes = await self._shared_swarm(public_key)
+        if not snodes:
+            async with self.swarm_lookup_semaphore:
+                with metrics.timer("pysession_swarm_lookup_seconds"):
+                    snodes = await self.fetch_swarm(public_key)
+            self._share_swarm(public_key, snodes)
+        self.swarm_map.set(public_key, snodes)
+        return snodes
+
+    async def _shared_swarm(self, public_key: str) -> Tuple[Node, ...]:
+        """Swarm found by another process, resolved through the node list"""
+        if self.shared is None:
+            return ()
+        swarm_id = self.shared.get_swarm(public_key, self.swarm_map.ttl)
+        if swarm_id is None:
+            return ()
+        snapshot = await self.node_registry.ensure_loaded()
+        return snapshot.swarm(swarm_id)
+
+    def _share_swarm(self, public_key: str, snodes: Tuple[Node, ...]):
+        if self.shared is None:
+            return
+        # Swarms returned by storage nodes don't include their id
+        snapshot = self.node_registry.snapshot
+        for snode in snodes:
+            node = snapshot.get(snode.ip, snode.port)
+            if node is not None and node.swarm_id is not None:
+                self.shared.set_swarm(public_key, node.swarm_id)
+                return
 
     async def get_swarm_node_url(self, public_key: str) -> str:
         """Retrieve a single swarm node url"""
         if not public_key or len(public_key) < 66:
             raise Exception(f"Invalid public key: {public_key}, {len(public_key)}")
 
-        if (
-            not self.swarm_map[public_key]
-            or time.time() - self.swarm_map[public_key] > 3600
-        ):
-            async with self.swarm_url_lock:
-                node_url = await self.random_storage_node(False)
-                node_data = await self.public_key_ask(
-                    node_url, "get_snode_for_pubkey", public_key
-                )
-                if not node_data:
-                    raise SwarmException(
-                        f"Could not get storage nodes from {node_url} pub: {public_key}"
-                    )
-                if not "snodes" in node_data:
-                    raise SwarmException(
-                        f"Could not get storage nodes object from {node_url}, {public_key}"
+        # Old swarms are refreshed by the cache in the background
+        snodes = self.swarm_map.get(public_key)
+        if not snodes:
+            snodes = await self.lookup_swarm(public_key)
+
+        return self.selector.choose([node.url for node in snodes])
+
+    async def swarm_node_urls(self, public_key: str, count: int) -> List[str]:
+        """Pick up to `count` different nodes from the swarm of a public key"""
+        snodes = self.swarm_map.get(public_key) or await self.lookup_swarm(public_key)
+        remaining = list({node.url for node in snodes})
+
+        urls = []
+        while remaining and len(urls) < count:
+            url = self.selector.choose(remaining)
+            remaining.remove(url)
+            urls.append(url)
+        return urls
+
+    async def ask_swarm_hedged(
+        self,
+        public_key: str,
+        method: str,
+        params: dict = {},
+        hedge_after: Optional[float] = None,
+        max_requests: int = 2,
+    ):
+        """Ask a swarm node and ask another one when the first is slow.
+
+        A new request is started every `hedge_after` seconds (by default the 95th
+        percentile of recent latencies) until `max_requests` are in flight. The first
+        good answer wins and the other requests are cancelled.
+        """
+        urls = await self.swarm_node_urls(public_key, max_requests)
+        if not urls:
+            raise SwarmException(f"No swarm nodes for {public_key}")
+        if hedge_after is None:
+            hedge_after = self.selector.latency_percentile(95)
+
+        pending = set()
+        error: Optional[BaseException] = None
+        try:
+            while urls or pending:
+                if urls:
+                    pending.add(
+                        asyncio.ensure_future(
+                            self.ask_public_key(urls.pop(0), method, public_key, params)
+                        )
                     )
 
-        random_node = random.choice(self.swarm_map[public_key].snodes)
-        return f"https://{random_node.ip}:{random_node.port}/storage_rpc/v1"
+                # Only wait for the hedge delay while there are nodes left
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=hedge_after if urls else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise SwarmException(f"No swarm node answered for {public_key}") from error
+
+    async def ask_swarm_quorum(
+        self,
+        public_key: str,
+        method: str,
+        params: dict = {},
+        count: int = 3,
+        quorum: int = 2,
+        merge: Optional[Callable[[List[Any]], Any]] = None,
+    ):
+        """Ask `count` swarm nodes in parallel and return once `quorum` agree.
+
+        Without `merge` the first answer given by `quorum` nodes is returned. With
+        `merge` the first `quorum` answers are combined by the merge function.
+        Requests that are still running are cancelled.
+        """
+        urls = await self.swarm_node_urls(public_key, count)
+        if len(urls) < quorum:
+            raise SwarmException(f"Not enough swarm nodes for {public_key}")
+
+        pending = {
+            asyncio.ensure_future(self.ask_public_key(url, method, public_key, params))
+            for url in urls
+        }
+        answers: List[Any] = []
+        votes: Dict[str, int] = {}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+
+                    answer = task.result()
+                    answers.append(answer)
+                    if merge is not None:
+                        if len(answers) >= quorum:
+                            return merge(answers)
+                        continue
+
+                    vote = json.dumps(answer, sort_keys=True)
+                    votes[vote] = votes.get(vote, 0) + 1
+                    if votes[vote] >= quorum:
+                        return answer
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise SwarmException(
+            f"No quorum of {quorum} out of {len(urls)} nodes for {public_key}"
+        ) from error
 
     # TODO: from node-session-client. We have the pubkey we can just internally look up the url?
-    # TODO maybe do 3 queries here and show confirmiations.s
-    async def ask_public_key(self, url, method, public_key, params={}):
-        # Handle exception
-        async with request_jsonrpc(
-            url, method, {**params, "pubKey": public_key}, ignore_self_signed=True
-        ) as result:
-            if "snodes" in result:
-                self.swarm_map[public_key] = {
-                    "updated_at": time.time(),
-                    "snodes": result["snodes"],
-                }
-
-                if method != "get_snodes_for_pubkey":
-                    # TODO: logging. swarm reorg is not valid
-                    return await self.ask_public_key(
-                        await self.get_swarm_node_url(public_key),
-                        method,
-                        public_key,
-                        params,
+    async def ask_public_key(
+        self, url, method, public_key, params={}, max_reorgs: int = 2
+    ):
+        result = await self.request_node(url, method, {**params, "pubKey": public_key})
+        if "snodes" in result:
+            self.swarm_map.set(
+                public_key, tuple(Node.from_dict(node) for node in result["snodes"])
+            )
+
+            if method != "get_snodes_for_pubkey":
+                # TODO: logging. swarm reorg is not valid
+                if metrics.enabled:
+                    metrics.inc("pysession_swarm_reorgs_total", method=method)
+                if max_reorgs <= 0:
+                    raise SwarmReorganised(
+                        f"Swarm of {public_key} changed while calling `{method}`"
                     )
+                return await self.ask_public_key(
+                    await self.get_swarm_node_url(public_key),
+                    method,
+                    public_key,
+                    params,
+                    max_reorgs - 1,
+                )
+
+        # Messages are retrieved by retrieve.MessagePoller
+        return result
 
-            # TODO: Implement message retrieving
-            return result
+    async def close(self):
+        """Stop background work and save the snapshot"""
+        await self.swarm_map.close()
+        await self.node_registry.close()
+        if self.snapshot_path:
+            self.save_snapshot()
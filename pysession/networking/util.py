@@ -1,62 +1,541 @@
 """Utilities for sending async post requests"""
 
-from typing import Any, Callable, Dict
+import asyncio
+import contextvars
+import itertools
+import random
+import ssl
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple, Type
 
 import aiohttp
 
-# TODO: create test case for "request_jsonrpc"
-# TODO: prevent recreating of session objects
+from ..metrics import metrics
 
+DEFAULT_TIMEOUT = 30
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 15
 
-async def request_text(url: str, **kwargs) -> str:
+# Monotonic time at which the current call chain has to be finished
+_deadline: contextvars.ContextVar = contextvars.ContextVar("deadline", default=None)
+
+
+class RequestError(Exception):
+    """Base class of all errors raised while requesting a node"""
+
+    def __init__(self, url: str, message: str):
+        super().__init__(f"{message} ({url})")
+        self.url = url
+
+
+class RequestTimeout(RequestError):
+    def __init__(self, url: str):
+        super().__init__(url, "Request timed out")
+
+
+class RequestConnectionError(RequestError):
+    pass
+
+
+class HTTPStatusError(RequestError):
+    def __init__(self, url: str, status: int):
+        super().__init__(url, f"Unexpected status {status}")
+        self.status = status
+
+
+class JsonRpcError(RequestError):
+    def __init__(self, url: str, error: Any):
+        if isinstance(error, dict):
+            self.code = error.get("code")
+            message = error.get("message", str(error))
+        else:
+            self.code = None
+            message = str(error)
+        super().__init__(url, f"Jsonrpc error {self.code}: {message}")
+
+
+# Errors worth trying again, possibly on another node
+TRANSIENT_ERRORS: Tuple[Type[Exception], ...] = (
+    RequestTimeout,
+    RequestConnectionError,
+)
+
+
+def is_transient(error: BaseException) -> bool:
+    if isinstance(error, HTTPStatusError):
+        return error.status >= 500 or error.status == 429
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+@contextmanager
+def deadline(seconds: float):
+    """Limit all requests made inside the block, including nested calls.
+
+    An existing, earlier deadline is kept.
+    """
+    at = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(current, at))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current deadline, None without a deadline"""
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+async def retry(
+    call: Callable[[], Awaitable[Any]],
+    attempts: int = 3,
+    base_delay: float = 0.1,
+    max_delay: float = 2.0,
+):
+    """Call again on transient errors with jittered exponential backoff.
+
+    Stops early when the delay would not fit in the current deadline.
+    """
+    for attempt in range(attempts):
+        try:
+            return await call()
+        except RequestError as e:
+            if attempt + 1 >= attempts or not is_transient(e):
+                raise
+
+            delay = random.uniform(0, min(max_delay, base_delay * 2**attempt))
+            left = remaining()
+            if left is not None and left <= delay:
+                raise
+            if metrics.enabled:
+                metrics.inc("pysession_retries_total", error=type(e).__name__)
+            await asyncio.sleep(delay)
+
+
+# Unique ids for batched jsonrpc calls
+_jsonrpc_ids = itertools.count(1)
+
+# Nodes that answered a batch with something other than a response array
+_batch_unsupported: Set[str] = set()
+
+
+class Client:
+    """Long-lived http client that shares one pooled connector between requests.
+
+    The underlying aiohttp session is created lazily inside the running event loop
+    and keeps connections alive, so repeated requests to a node skip the tcp and
+    tls handshakes, and caches dns lookups. asyncio does not resume tls sessions,
+    every new connection does a full handshake.
+    """
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 8,
+        keepalive_timeout: float = 30.0,
+        dns_cache_ttl: int = 300,
+        ssl_context: Optional[ssl.SSLContext] = None,
+        timeout: float = DEFAULT_TIMEOUT,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: float = DEFAULT_READ_TIMEOUT,
+    ):
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.ssl_context = ssl_context or ssl.create_default_context()
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Close tasks of sessions left behind by a closed event loop
+        self._closing: Set[asyncio.Task] = set()
+
+    @property
+    def closed(self) -> bool:
+        return self._session is None or self._session.closed
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            use_dns_cache=True,
+            ttl_dns_cache=self.dns_cache_ttl,
+            ssl=self.ssl_context,
+        )
+        # Only sessions created while metrics are enabled are traced
+        trace_configs = [_trace_config()] if metrics.enabled else None
+        return aiohttp.ClientSession(connector=connector, trace_configs=trace_configs)
+
+    def session(self) -> aiohttp.ClientSession:
+        """Return the shared session, (re)creating it for the running event loop"""
+        loop = asyncio.get_running_loop()
+
+        # Sessions are bound to the loop they were created in
+        if not self.closed and self._loop is not loop:
+            self._discard_session(loop)
+        if self.closed:
+            self._session = self._create_session()
+            self._loop = loop
+
+        return self._session
+
+    def _discard_session(self, loop: asyncio.AbstractEventLoop):
+        """Close the session of another event loop before it is replaced"""
+        session, old_loop = self._session, self._loop
+        if old_loop.is_running():
+            asyncio.run_coroutine_threadsafe(session.close(), old_loop)
+        elif old_loop.is_closed():
+            # Its connections died with the loop, closing only releases the pool
+            task = loop.create_task(session.close())
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+        else:
+            raise RuntimeError(
+                "The client session belongs to another open event loop, "
+                "close the client in that loop first"
+            )
+        self._session = None
+        self._loop = None
+
+    def _timeout(self, total: Optional[float]) -> aiohttp.ClientTimeout:
+        left = remaining()
+        if left is not None:
+            total = left if total is None else min(total, left)
+
+        return aiohttp.ClientTimeout(
+            total=total,
+            sock_connect=self.connect_timeout,
+            sock_read=self.read_timeout,
+        )
+
+    def request(self, method: str, url: str, **kwargs):
+        """Do a request with the shared session. Use as async context manager.
+
+        The total timeout is capped by the current `deadline`.
+        """
+        left = remaining()
+        if left is not None and left <= 0:
+            raise RequestTimeout(url)
+
+        timeout = kwargs.get("timeout", self.timeout)
+        if not isinstance(timeout, aiohttp.ClientTimeout):
+            kwargs["timeout"] = self._timeout(timeout)
+
+        return self.session().request(method, url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def get(self, url: str, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url: str, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    async def close(self):
+        """Close the session and all pooled connections"""
+        if not self.closed:
+            await self._session.close()
+        self._session = None
+        self._loop = None
+
+    async def __aenter__(self) -> "Client":
+        self.session()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+def _host(url) -> str:
+    return f"{url.host}:{url.port}"
+
+
+async def _on_request_start(session, context, params):
+    context.start = time.monotonic()
+
+
+async def _on_request_end(session, context, params):
+    host = _host(params.url)
+    metrics.observe(
+        "pysession_http_request_seconds", time.monotonic() - context.start, host=host
+    )
+    metrics.inc(
+        "pysession_http_requests_total", host=host, status=params.response.status
+    )
+
+
+async def _on_request_exception(session, context, params):
+    metrics.inc("pysession_http_request_errors_total", host=_host(params.url))
+
+
+async def _on_request_chunk_sent(session, context, params):
+    metrics.inc(
+        "pysession_http_sent_bytes_total", len(params.chunk), host=_host(params.url)
+    )
+
+
+async def _on_response_chunk_received(session, context, params):
+    metrics.inc(
+        "pysession_http_received_bytes_total",
+        len(params.chunk),
+        host=_host(params.url),
+    )
+
+
+async def _on_connection_create_end(session, context, params):
+    metrics.inc("pysession_http_connections_created_total")
+
+
+async def _on_connection_reuseconn(session, context, params):
+    metrics.inc("pysession_http_connections_reused_total")
+
+
+def _trace_config() -> aiohttp.TraceConfig:
+    """Record latency, transferred bytes and connection reuse of a session"""
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(_on_request_start)
+    trace_config.on_request_end.append(_on_request_end)
+    trace_config.on_request_exception.append(_on_request_exception)
+    trace_config.on_request_chunk_sent.append(_on_request_chunk_sent)
+    trace_config.on_response_chunk_received.append(_on_response_chunk_received)
+    trace_config.on_connection_create_end.append(_on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(_on_connection_reuseconn)
+    return trace_config
+
+
+_default_client: Optional[Client] = None
+
+
+def get_client() -> Client:
+    """Return the process wide client used when no client is given"""
+    global _default_client
+    if _default_client is None:
+        _default_client = Client()
+    return _default_client
+
+
+async def close_client():
+    """Close the process wide client"""
+    global _default_client
+    if _default_client is not None:
+        await _default_client.close()
+        _default_client = None
+
+
+async def _request(url: str, read: Callable, client: Optional[Client], **kwargs):
+    """Post and read the response, converting errors into a RequestError"""
+    client = client or get_client()
+    try:
+        async with client.post(url, **kwargs) as response:
+            if response.status != 200:
+                raise HTTPStatusError(url, response.status)
+            return await read(response)
+    except asyncio.TimeoutError as e:
+        raise RequestTimeout(url) from e
+    except aiohttp.ClientConnectionError as e:
+        raise RequestConnectionError(url, str(e) or type(e).__name__) from e
+
+
+async def request_text(url: str, client: Optional[Client] = None, **kwargs) -> str:
     """Do a post request and return the retrieved data as str"""
-    # Inject timeout of 30 seconds
-    if "timeout" not in kwargs:
-        kwargs["timeout"] = 30
+    return await _request(url, lambda response: response.text(), client, **kwargs)
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, **kwargs) as response:
-            assert response.status == 200
-            return await response.text()
 
+async def request_json(
+    url: str,
+    client: Optional[Client] = None,
+    decode: Optional[Callable[[bytes], Any]] = None,
+    **kwargs,
+) -> dict:
+    """Do an async post request and parse the returned json object.
 
-async def request_json(url: str, **kwargs) -> dict:
-    """Do an async post request and parse the returned json object"""
-    # Inject timeout of 30 seconds
-    if "timeout" not in kwargs:
-        kwargs["timeout"] = 30
+    `decode` parses the raw body instead of `json.loads`, see `decode.decode_nodes`.
+    """
+    if decode is None:
+        return await _request(url, lambda response: response.json(), client, **kwargs)
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, **kwargs) as response:
-            assert response.status == 200
-            return await response.json()
+    async def read(response):
+        return decode(await response.read())
+
+    return await _request(url, read, client, **kwargs)
+
+
+async def request_bytes(url: str, client: Optional[Client] = None, **kwargs) -> bytes:
+    """Do an async post request and return the raw body"""
+    return await _request(url, lambda response: response.read(), client, **kwargs)
 
 
 async def request_stream(
-    url: str, stream_callback: Callable, **kwargs
+    url: str, stream_callback: Callable, client: Optional[Client] = None, **kwargs
 ) -> aiohttp.StreamReader:
     """Request a stream with a callback. This can be used for retrieving large binary blobs"""
-    # Inject timeout of 30 seconds
-    if "timeout" not in kwargs:
-        kwargs["timeout"] = 30
-
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, **kwargs) as response:
-            assert response.status == 200
-            return await stream_callback(response.content)
+    return await _request(
+        url, lambda response: stream_callback(response.content), client, **kwargs
+    )
 
 
 async def request_jsonrpc(
     url: str,
-    method: Dict[str, Any],
+    method: str,
     params: Dict[str, Any],
     ignore_self_signed: bool = False,
+    client: Optional[Client] = None,
+    onion: Optional[Any] = None,
+    decode: Optional[Callable[[bytes], Any]] = None,
 ):
+    """Send a jsonrpc request, through onion paths when an `OnionPathPool` is given.
+
+    `decode` is only used for direct requests, onion responses are already parsed.
+    """
     if not url:
         raise Exception("No url given")
 
+    if onion is not None:
+        return await onion.request_jsonrpc(url, method, params)
+
     body = {"jsonrpc": "2.0", "id": "0", "method": method, "params": params}
     headers = {"Content-Type": "application/json"}
-    return await request_json(
-        url, json=body, headers=headers, verify=not ignore_self_signed
+
+    # Storage nodes use self signed certificates
+    kwargs = {"ssl": False} if ignore_self_signed else {}
+    result = await request_json(
+        url, client=client, decode=decode, json=body, headers=headers, **kwargs
     )
+    if isinstance(result, dict) and result.get("error") is not None:
+        raise JsonRpcError(url, result["error"])
+    return result
+
+
+class JsonRpcBatch:
+    """Collect jsonrpc calls for a single node and send them as one request array.
+
+    Every call gets a future that resolves with its own response object. Nodes that
+    reject batches are remembered and receive individual requests instead, other
+    failures of the request are set on all futures.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        ignore_self_signed: bool = False,
+        client: Optional[Client] = None,
+    ):
+        if not url:
+            raise Exception("No url given")
+
+        self.url = url
+        self.ignore_self_signed = ignore_self_signed
+        self.client = client
+        self._calls: List[Tuple[str, str, Dict[str, Any], asyncio.Future]] = []
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def add(self, method: str, params: Dict[str, Any]) -> asyncio.Future:
+        """Queue a call and return the future of its response"""
+        future = asyncio.get_running_loop().create_future()
+        self._calls.append((str(next(_jsonrpc_ids)), method, params, future))
+        return future
+
+    async def send(self):
+        """Send all queued calls and resolve their futures"""
+        calls, self._calls = self._calls, []
+        if not calls:
+            return
+
+        if len(calls) == 1 or self.url in _batch_unsupported:
+            await self._send_individually(calls)
+            return
+
+        body = [
+            {"jsonrpc": "2.0", "id": call_id, "method": method, "params": params}
+            for call_id, method, params, _ in calls
+        ]
+        headers = {"Content-Type": "application/json"}
+        kwargs = {"ssl": False} if self.ignore_self_signed else {}
+
+        try:
+            responses = await request_json(
+                self.url, client=self.client, json=body, headers=headers, **kwargs
+            )
+        except aiohttp.ContentTypeError:
+            responses = None
+        except Exception as e:
+            # Only a client error means that the node rejected the batch
+            if not (
+                isinstance(e, HTTPStatusError)
+                and not is_transient(e)
+                and 400 <= e.status < 500
+            ):
+                self._fail(calls, e)
+                return
+            responses = None
+
+        if not isinstance(responses, list):
+            _batch_unsupported.add(self.url)
+            await self._send_individually(calls)
+            return
+
+        # Demultiplex responses by their id
+        by_id = {
+            response.get("id"): response
+            for response in responses
+            if isinstance(response, dict)
+        }
+        for call_id, method, _, future in calls:
+            if future.done():
+                continue
+            response = by_id.get(call_id)
+            if response is not None and response.get("error") is not None:
+                future.set_exception(JsonRpcError(self.url, response["error"]))
+            elif response is not None:
+                future.set_result(response)
+            else:
+                future.set_exception(
+                    RequestError(self.url, f"No response for `{method}` in batch")
+                )
+
+    @staticmethod
+    def _fail(calls, error: Exception):
+        for _, _, _, future in calls:
+            if not future.done():
+                future.set_exception(error)
+
+    async def _send_individually(self, calls):
+        results = await asyncio.gather(
+            *(
+                request_jsonrpc(
+                    self.url, method, params, self.ignore_self_signed, self.client
+                )
+                for _, method, params, _ in calls
+            ),
+            return_exceptions=True,
+        )
+        for (_, _, _, future), result in zip(calls, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+async def request_jsonrpc_batch(
+    url: str,
+    calls: List[Tuple[str, Dict[str, Any]]],
+    ignore_self_signed: bool = False,
+    client: Optional[Client] = None,
+) -> list:
+    """Send many (method, params) pairs to one node and return the responses in order"""
+    batch = JsonRpcBatch(url, ignore_self_signed, client)
+    futures = [batch.add(method, params) for method, params in calls]
+    await batch.send()
+    return await asyncio.gather(*futures)
@@ -0,0 +1,46 @@
+"""Unit test for /pysession/cryptography/bulk.py"""
+
+import pytest
+
+from pysession.cryptography.bulk import derive_keys
+from pysession.cryptography.mnemonic import KeyPair
+
+
+@pytest.fixture
+def words() -> str:
+    return "spout suffice lynx factual lexicon gigantic dodge roared lawsuit bluntly cycling meant lexicon"
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_derive_keys(words, workers):
+    """Records should match KeyPair and errors should not stop the batch"""
+    seed = bytes.fromhex("dbfadcb2190181d98c13f8c07ed7765a")
+    sources = [words, " ".join(["banana"] * 13), seed, seed[:8]]
+
+    records = list(derive_keys(sources, workers=workers, chunk_size=2))
+    expected = KeyPair.from_words(words)
+
+    assert [record.position for record in records] == [0, 1, 2, 3]
+    assert records[0].public_key == expected._pub
+    assert records[0].secret_key == expected._sec
+    assert records[1].error == "Invalid word `banana` in mnemonic"
+    assert records[2].public_key == expected._pub
+    assert records[2].mnemonic == words
+    assert records[3].error == "Seed must be 16 bytes long"
+
+
+def test_derive_new_keys():
+    """A count should generate that many new identities"""
+    records = list(derive_keys(5, workers=0))
+    assert len({record.public_key for record in records}) == 5
+    for record in records:
+        assert KeyPair.from_words(record.mnemonic)._pub == record.public_key
+
+
+def test_derive_invalid_seed():
+    """A bad seed should produce an error record next to the good one"""
+    records = list(derive_keys([b"\x00" * 4, None], workers=0))
+
+    assert records[0].error == "Seed must be 16 bytes long"
+    assert records[1].error is None
+    assert KeyPair.from_words(records[1].mnemonic)._pub == records[1].public_key
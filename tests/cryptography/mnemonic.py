@@ -4,7 +4,13 @@ import os
 
 import pytest
 
-from pysession.cryptography.mnemonic import KeyPair, MnemonicError, swap_endian_bytes
+from pysession.cryptography.mnemonic import (
+    KeyPair,
+    MnemonicError,
+    seed_to_words,
+    swap_endian_bytes,
+    words_to_seed,
+)
 
 
 @pytest.fixture
@@ -150,3 +156,80 @@ def test_from_enviroment_v2(words, public_key_v2):
     setattr(os, "environ", envs)
     pair = KeyPair.from_env(prefix="TEST_")
     assert pair._pub == public_key_v2
+
+
+def test_language_shared(words):
+    """Languages should only be loaded once per process"""
+    first = KeyPair.from_words(words)
+    second = KeyPair(language="english")
+    assert first.wordlist is second.wordlist
+    assert first.wordlist.index("lexicon") == first.wordset.index("lexicon")
+
+
+def test_abbreviated_words(words, public_key_v3):
+    """Words can be shortened to their unique prefix"""
+    abbreviated = " ".join(word[:4] for word in words.split(" "))
+    pair = KeyPair.from_words(abbreviated)
+    assert pair._pub == public_key_v3
+    assert pair.words == words.split(" ")[:-1]
+
+
+def test_seed_codec(words):
+    """Seeds should survive a round trip through the mnemonic codec"""
+    seed = bytes.fromhex("dbfadcb2190181d98c13f8c07ed7765a")
+    assert seed_to_words(seed) == words.split(" ")
+    assert words_to_seed(words.split(" ")) == seed
+
+    seed = os.urandom(16)
+    assert words_to_seed(seed_to_words(seed)) == seed
+
+    with pytest.raises(MnemonicError, match="too short"):
+        words_to_seed([])
+
+
+def test_lazy_keys(words, public_key_v3):
+    """Keys should only be derived when they are used"""
+    pair = KeyPair.from_words(words)
+    assert pair._private_key is None
+
+    assert pair._pub == public_key_v3
+    signing_key = pair.signing_key
+    assert pair.signing_key is signing_key
+    assert pair._sec == pair.private_key.encode()
+
+    signature = pair.sign(b"message")
+    signing_key.verify_key.verify(b"message", signature)
+
+
+def test_v2_has_no_signing_key(words):
+    """Version 2 seeds only have a curve25519 key"""
+    pair = KeyPair.from_words(words, version=2)
+    try:
+        pair.signing_key
+        assert False
+    except MnemonicError as ex:
+        assert ex.args[0] == "Only version 3 seeds have a signing key"
+
+
+def test_encryption(words):
+    """Messages should be readable by the recipient and the shared key cached"""
+    sender = KeyPair.from_words(words)
+    recipients = [KeyPair.new_keys() for _ in range(3)]
+
+    ciphertexts = sender.encrypt_many(
+        [recipient.get_public_key() for recipient in recipients], b"hello"
+    )
+    for recipient in recipients:
+        ciphertext = ciphertexts[recipient.get_public_key()]
+        assert recipient.decrypt(sender.get_public_key(), ciphertext) == b"hello"
+
+    assert len(sender._boxes) == 3
+    sender.box_cache_size = 1
+    sender.encrypt(KeyPair.new_keys()._pub, b"hello")
+    assert len(sender._boxes) == 1
+
+    try:
+        sender.encrypt("00" * 33, b"hello")
+        assert False
+    except MnemonicError:
+        pass
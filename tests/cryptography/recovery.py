@@ -0,0 +1,80 @@
+"""Unit test for /pysession/cryptography/recovery.py"""
+
+import pytest
+
+from pysession.cryptography.mnemonic import KeyPair, MnemonicError
+from pysession.cryptography.recovery import edit_distance, public_key_from_seed, recover
+
+
+@pytest.fixture
+def words() -> str:
+    return "spout suffice lynx factual lexicon gigantic dodge roared lawsuit bluntly cycling meant lexicon"
+
+
+def test_public_key_from_seed():
+    seed = bytes.fromhex("dbfadcb2190181d98c13f8c07ed7765a")
+    for version in (2, 3):
+        expected = KeyPair.from_seed(seed, version=version)._pub
+        assert public_key_from_seed(seed, version) == expected
+
+
+def test_misspelled_word(words):
+    """The nearest word that passes the checksum should be ranked first"""
+    typed = words.replace("factual", "factaul")
+    results = recover(typed)
+
+    assert edit_distance("factaul", "factual") == 2
+    assert results[0].mnemonic == words
+    assert results[0].replaced == ((3, "factual"),)
+    assert results == sorted(results, key=lambda result: result.distance)
+    assert all(KeyPair.from_words(result.mnemonic) for result in results)
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_public_key(words, workers):
+    """Two unknown words should be found with the public key"""
+    public_key = KeyPair.from_words(words).get_public_key()
+    typed = words.split()
+    typed[1] = "suffise"
+    typed[9] = "?"
+
+    results = recover(typed, public_key=public_key, workers=workers)
+    assert len(results) == 1
+    assert results[0].mnemonic == words
+    assert results[0].seed == bytes.fromhex("dbfadcb2190181d98c13f8c07ed7765a")
+
+
+def test_valid_words(words):
+    """A valid word in the wrong place should be found by trying every position"""
+    public_key = KeyPair.from_words(words).get_public_key()
+    assert recover(words)[0].distance == 0
+
+    typed = words.replace("roared", "abbey")
+    results = recover(typed, public_key=public_key)
+    assert [result.mnemonic for result in results] == [words]
+
+    # A valid word that also passes the checksum is only found with the key
+    typed = words.replace("spout", "academy")
+    assert recover(typed)[0].mnemonic == typed
+    results = recover(typed, public_key=public_key)
+    assert [result.mnemonic for result in results] == [words]
+
+    with pytest.raises(MnemonicError):
+        recover("? ? ? " + " ".join(words.split()[3:]))
+
+
+def test_checksum_word(words):
+    """A wrong or unknown checksum word should be recomputed"""
+    public_key = KeyPair.from_words(words).get_public_key()
+    data = words.split()[:-1]
+
+    for typed in (data + ["?"], data + ["lexicn"]):
+        results = recover(typed)
+        assert [result.mnemonic for result in results] == [words]
+        assert results[0].replaced == ((12, "lexicon"),)
+        assert KeyPair.from_words(results[0].mnemonic)
+
+    typed = data + ["spout"]
+    assert words in [result.mnemonic for result in recover(typed)]
+    results = recover(typed, public_key=public_key)
+    assert [result.mnemonic for result in results] == [words]
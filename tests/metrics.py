@@ -0,0 +1,105 @@
+from contextlib import asynccontextmanager
+
+import pytest
+from aiohttp import web
+
+from pysession.cryptography.mnemonic import KeyPair
+from pysession.metrics import Metrics, metrics
+from pysession.networking.cache import SwarmCache
+from pysession.networking.util import Client, request_text
+
+
+@asynccontextmanager
+async def local_server(handler):
+    app = web.Application()
+    app.router.add_post("/", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    try:
+        yield "127.0.0.1:%d" % runner.addresses[0][1]
+    finally:
+        await runner.cleanup()
+
+
+@pytest.fixture
+def enabled_metrics():
+    metrics.reset()
+    metrics.enable()
+    yield metrics
+    metrics.disable()
+    metrics.reset()
+
+
+def test_render():
+    """Counters and histograms should be rendered in the Prometheus text format"""
+    registry = Metrics(buckets=(0.1, 1))
+    registry.inc("requests_total", node='a"b')
+    registry.inc("requests_total", 2, node='a"b')
+    registry.observe("latency_seconds", 0.05)
+    registry.observe("latency_seconds", 0.5)
+    registry.observe("latency_seconds", 5)
+
+    assert registry.get("requests_total", node='a"b') == 3
+    assert registry.render().splitlines() == [
+        "# TYPE requests_total counter",
+        'requests_total{node="a\\"b"} 3',
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        "latency_seconds_sum 5.55",
+        "latency_seconds_count 3",
+    ]
+    assert (
+        registry.render(openmetrics=True).splitlines()[0] == "# TYPE requests counter"
+    )
+
+
+def test_disabled():
+    """Nothing should be recorded while metrics are disabled"""
+    metrics.reset()
+    cache = SwarmCache()
+    cache.get("missing")
+    KeyPair.new_keys().get_public_key()
+    assert metrics.render() == "\n"
+
+
+def test_listeners(enabled_metrics):
+    recorded = []
+    enabled_metrics.add_listener(lambda *args: recorded.append(args))
+
+    cache = SwarmCache()
+    cache.set("key", ("node",))
+    cache.get("key")
+    cache.get("missing")
+    KeyPair.new_keys().get_public_key()
+
+    assert ("pysession_swarm_cache_lookups_total", 1, {"result": "hit"}) in recorded
+    assert ("pysession_swarm_cache_lookups_total", 1, {"result": "miss"}) in recorded
+    assert enabled_metrics.histogram("pysession_key_derivation_seconds", version=3)
+    enabled_metrics.listeners.clear()
+
+
+@pytest.mark.asyncio
+async def test_http_metrics(enabled_metrics):
+    """Traced sessions should record latency, bytes and connection reuse"""
+
+    async def handler(request):
+        await request.read()
+        return web.Response(text="pong")
+
+    async with local_server(handler) as host:
+        async with Client() as client:
+            for _ in range(3):
+                result = await request_text(
+                    f"http://{host}/", client=client, data=b"ping"
+                )
+                assert result == "pong"
+
+    histogram = enabled_metrics.histogram("pysession_http_request_seconds", host=host)
+    assert histogram.count == 3
+    assert enabled_metrics.get("pysession_http_sent_bytes_total", host=host) == 12
+    assert enabled_metrics.get("pysession_http_connections_created_total") == 1
+    assert enabled_metrics.get("pysession_http_connections_reused_total") == 2
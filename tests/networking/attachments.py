@@ -0,0 +1,163 @@
+"""Unit test for /pysession/networking/attachments.py"""
+
+import os
+
+import pytest
+from aiohttp import web
+
+from pysession.networking.attachments import (
+    AttachmentError,
+    download,
+    encrypt_chunks,
+    file_chunks,
+    generate_key,
+    upload,
+)
+from pysession.networking.util import Client
+
+
+async def serve(tmp_path):
+    """Serve files from tmp_path and store uploads as `upload.bin`"""
+
+    async def store(request):
+        with open(tmp_path / "upload.bin", "wb") as target:
+            async for data in request.content.iter_chunked(4096):
+                target.write(data)
+        return web.Response(text="ok")
+
+    app = web.Application()
+    app.router.add_static("/files", tmp_path)
+    app.router.add_post("/upload", store)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    return runner, f"http://127.0.0.1:{runner.addresses[0][1]}"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("connections", [1, 3])
+async def test_encrypted_round_trip(tmp_path, connections):
+    """Uploaded attachments should be downloaded and decrypted unchanged"""
+    data = os.urandom(100_000)
+    (tmp_path / "source.bin").write_bytes(data)
+    key = generate_key()
+    progress = []
+
+    runner, url = await serve(tmp_path)
+    try:
+        async with Client() as client:
+            await upload(
+                url + "/upload",
+                str(tmp_path / "source.bin"),
+                key=key,
+                chunk_size=4096,
+                client=client,
+            )
+            received = await download(
+                url + "/files/upload.bin",
+                str(tmp_path / "result.bin"),
+                key=key,
+                chunk_size=4096,
+                connections=connections,
+                progress=lambda done, total: progress.append(done),
+                client=client,
+            )
+    finally:
+        await runner.cleanup()
+
+    assert (tmp_path / "result.bin").read_bytes() == data
+    assert received == progress[-1] == os.path.getsize(tmp_path / "upload.bin")
+    assert not (tmp_path / "result.bin.part").exists()
+
+
+@pytest.mark.asyncio
+async def test_resume_download(tmp_path):
+    """Only the missing part should be downloaded after an interruption"""
+    data = os.urandom(50_000)
+    (tmp_path / "source.bin").write_bytes(data)
+    (tmp_path / "result.bin.part").write_bytes(data[:20_000])
+    (tmp_path / "result.bin.part.json").write_text(
+        '{"size": 50000, "segment_size": 0, "done": []}'
+    )
+
+    runner, url = await serve(tmp_path)
+    try:
+        async with Client() as client:
+            received = await download(
+                url + "/files/source.bin",
+                str(tmp_path / "result.bin"),
+                connections=1,
+                client=client,
+            )
+    finally:
+        await runner.cleanup()
+
+    assert received == 30_000
+    assert (tmp_path / "result.bin").read_bytes() == data
+
+
+@pytest.mark.asyncio
+async def test_resume_encrypted_download(tmp_path):
+    """Ciphertext received before an interruption should be decrypted first"""
+    data = os.urandom(50_000)
+    (tmp_path / "source.bin").write_bytes(data)
+    key = generate_key()
+    ciphertext = b"".join(
+        [
+            chunk
+            async for chunk in encrypt_chunks(
+                file_chunks(str(tmp_path / "source.bin"), 4096), key, 4096
+            )
+        ]
+    )
+    (tmp_path / "encrypted.bin").write_bytes(ciphertext)
+    (tmp_path / "result.bin.part").write_bytes(ciphertext[:10_000])
+    (tmp_path / "result.bin.part.json").write_text(
+        '{"size": %d, "segment_size": 0, "done": []}' % len(ciphertext)
+    )
+
+    runner, url = await serve(tmp_path)
+    try:
+        async with Client() as client:
+            received = await download(
+                url + "/files/encrypted.bin",
+                str(tmp_path / "result.bin"),
+                key=key,
+                chunk_size=4096,
+                connections=1,
+                client=client,
+            )
+    finally:
+        await runner.cleanup()
+
+    assert received == len(ciphertext) - 10_000
+    assert (tmp_path / "result.bin").read_bytes() == data
+    assert not (tmp_path / "result.bin.part.plain").exists()
+
+
+@pytest.mark.asyncio
+async def test_truncated_attachment(tmp_path):
+    """Missing chunks should be detected"""
+    (tmp_path / "source.bin").write_bytes(os.urandom(10_000))
+    key = generate_key()
+    chunks = [
+        chunk
+        async for chunk in encrypt_chunks(
+            file_chunks(str(tmp_path / "source.bin"), 4096), key, 4096
+        )
+    ]
+    (tmp_path / "cut.bin").write_bytes(b"".join(chunks[:-1]))
+
+    runner, url = await serve(tmp_path)
+    try:
+        async with Client() as client:
+            with pytest.raises(AttachmentError):
+                await download(
+                    url + "/files/cut.bin",
+                    str(tmp_path / "result.bin"),
+                    key=key,
+                    chunk_size=4096,
+                    client=client,
+                )
+    finally:
+        await runner.cleanup()
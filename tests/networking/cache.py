@@ -0,0 +1,51 @@
+"""Unit test for /pysession/networking/cache.py"""
+
+import asyncio
+
+import pytest
+
+from pysession.networking.cache import SwarmCache
+
+
+def test_lru_eviction():
+    """The least recently used entry should be evicted first"""
+    cache = SwarmCache(max_size=2)
+    cache.set("a", [1])
+    cache.set("b", [2])
+    assert cache.get("a") == [1]
+
+    cache.set("c", [3])
+    assert "b" not in cache
+    assert cache.get("a") == [1]
+    assert cache.get("b") is None
+    assert cache.stats["evictions"] == 1
+    assert cache.stats["hits"] == 2
+    assert cache.stats["misses"] == 1
+
+
+def test_expired_entry():
+    """Entries older than max_age should be treated as missing"""
+    cache = SwarmCache(ttl=0, max_age=0)
+    cache.set("a", [1])
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_stale_while_revalidate():
+    """Old entries should be served while they are refreshed in the background"""
+    refreshed = asyncio.Event()
+
+    async def refresh(public_key):
+        refreshed.set()
+        return ["new"]
+
+    cache = SwarmCache(refresh, ttl=60, refresh_after=0)
+    cache.set("a", ["old"])
+
+    assert cache.get("a") == ["old"]
+    await asyncio.wait_for(refreshed.wait(), 1)
+    await asyncio.sleep(0)
+    assert cache.get("a") == ["new"]
+    assert cache.stats["refreshes"] == 1
+    await cache.close()
@@ -0,0 +1,77 @@
+"""Unit test for /pysession/networking/decode.py"""
+
+import json
+
+import pytest
+
+from pysession.networking import decode
+from pysession.networking.decode import decode_nodes
+from pysession.networking.node import Node
+
+RESPONSE = json.dumps(
+    {
+        "jsonrpc": "2.0",
+        "id": "0",
+        "result": {
+            "block_hash": "ab",
+            "service_node_states": [
+                {
+                    "public_ip": "10.0.0.1",
+                    "storage_port": 22021,
+                    "pubkey_ed25519": "ed",
+                    "pubkey_x25519": "x",
+                    "swarm_id": 3,
+                    "requested_unlock_height": 0,
+                    "contributors": [{"address": "a", "ip": "1.2.3.4", "port": 1}],
+                },
+                {"ip": "10.0.0.2", "port": "22022"},
+            ],
+            "seed": {"public_ip": "10.0.0.3", "storage_port": 22023},
+        },
+    }
+).encode()
+
+
+@pytest.fixture(params=["orjson", "json"])
+def backend(request, monkeypatch):
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(decode, "orjson", None)
+    return request.param
+
+
+def test_decode_nodes(backend):
+    """Node objects are decoded into `Node` records, other objects stay dicts"""
+    result = decode_nodes(RESPONSE)
+
+    nodes = result["result"]["service_node_states"]
+    assert all(isinstance(node, Node) for node in nodes)
+    assert nodes == [
+        Node.from_dict(state)
+        for state in json.loads(RESPONSE)["result"]["service_node_states"]
+    ]
+    assert nodes[0].swarm_id == 3 and nodes[0].pubkey_x25519 == "x"
+    assert result["result"]["block_hash"] == "ab"
+    assert result["jsonrpc"] == "2.0"
+
+    # Objects with an ip and port outside of node lists stay dicts
+    assert isinstance(result["result"]["seed"], dict)
+
+
+def test_decode_snodes(backend):
+    """Swarm members of storage server responses are decoded as well"""
+    data = b'{"snodes": [{"ip": "10.0.0.1", "port": "22021"}], "swarm": 1}'
+    result = decode_nodes(data)
+
+    assert result["snodes"] == [Node("10.0.0.1", 22021)]
+    assert result["swarm"] == 1
+
+
+def test_loads(backend):
+    """Without node objects the result matches the json module"""
+    data = b'{"a": [1, 2.5, "b", null, {"c": true}]}'
+    assert decode.loads(data) == json.loads(data)
+    assert decode_nodes(data) == json.loads(data)
+    with pytest.raises(ValueError):
+        decode_nodes(b"{")
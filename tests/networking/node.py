@@ -0,0 +1,31 @@
+"""Unit test for /pysession/networking/node.py"""
+
+import pickle
+
+import pytest
+
+from pysession.networking.node import Node
+
+
+def test_node_formats():
+    """Both the oxend and the storage server format should create the same node"""
+    oxend = Node.from_dict(
+        {"public_ip": "10.0.0.1", "storage_port": 22021, "swarm_id": 3}
+    )
+    storage = Node.from_dict({"ip": "10.0.0.1", "port": "22021"})
+
+    assert oxend == storage
+    assert len({oxend, storage}) == 1
+    assert oxend.url == "https://10.0.0.1:22021/storage_rpc/v1"
+    assert oxend.swarm_id == 3
+
+
+def test_node_immutable():
+    """Nodes can't be changed after creation"""
+    node = Node("10.0.0.1", 1)
+    with pytest.raises(AttributeError):
+        node.ip = "10.0.0.2"
+    with pytest.raises(AttributeError):
+        node.extra = True
+
+    assert pickle.loads(pickle.dumps(node)).url == node.url
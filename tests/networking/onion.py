@@ -0,0 +1,120 @@
+"""Unit test for /pysession/networking/onion.py"""
+
+import json
+import os
+
+import aiohttp
+import nacl.public
+import pytest
+from aiohttp import web
+
+from pysession.networking import onion
+from pysession.networking.onion import OnionPathPool
+from pysession.networking.swarm import Swarm
+
+
+class HopServer:
+    """Local stand-in for a storage node that handles onion requests"""
+
+    def __init__(self, network, session):
+        self.network = network
+        self.session = session
+        self.key = nacl.public.PrivateKey.generate()
+        self.ed25519 = os.urandom(32).hex()
+        self.requests = []
+        self.ephemeral_keys = set()
+
+    @property
+    def state(self):
+        return {
+            "public_ip": "127.0.0.1",
+            "storage_port": self.port,
+            "pubkey_ed25519": self.ed25519,
+            "pubkey_x25519": self.key.public_key.encode().hex(),
+        }
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/onion_req/v2", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = self.runner.addresses[0][1]
+
+    async def handle(self, request):
+        ciphertext, meta = onion.decode_blob(await request.read())
+        self.ephemeral_keys.add(meta["ephemeral_key"])
+        key = onion.xchacha20_key(
+            self.key.encode(),
+            self.key.public_key.encode(),
+            bytes.fromhex(meta["ephemeral_key"]),
+            local_first=False,
+        )
+        plaintext = onion.decrypt(key, ciphertext)
+
+        try:
+            inner, routing = onion.decode_blob(plaintext)
+        except (onion.OnionError, ValueError):
+            routing = {}
+
+        if "destination" in routing:
+            # Relay to the next hop
+            next_hop = self.network[routing["destination"]]
+            self.requests.append("relay")
+            async with self.session.post(
+                f"http://127.0.0.1:{next_hop.port}/onion_req/v2",
+                data=onion.encode_blob(
+                    inner, {k: v for k, v in routing.items() if k != "destination"}
+                ),
+            ) as response:
+                return web.Response(body=await response.read())
+
+        body = json.loads(plaintext)
+        self.requests.append(body["method"])
+        result = {"method": body["method"], "port": self.port}
+        response = {"status": 200, "body": json.dumps(result)}
+        return web.Response(body=onion.encrypt(key, json.dumps(response).encode()))
+
+
+@pytest.mark.asyncio
+async def test_onion_request():
+    """Requests should travel through three hops and reuse the built path"""
+    network = {}
+    session = aiohttp.ClientSession()
+    servers = [HopServer(network, session) for _ in range(5)]
+    for server in servers:
+        await server.start()
+        network[server.ed25519] = server
+
+    swarm = Swarm()
+
+    async def fetch_service_nodes(block_hash=None):
+        return {"service_node_states": [server.state for server in servers]}
+
+    swarm.node_registry.fetch = fetch_service_nodes
+    pool = OnionPathPool(swarm, path_count=1, scheme="http")
+    swarm.onion = pool
+
+    try:
+        destination = servers[0]
+        url = f"https://127.0.0.1:{destination.port}/storage_rpc/v1"
+        for _ in range(3):
+            result = await swarm.request_node(url, "retrieve", {"pubKey": "05aa"})
+            assert result == {"method": "retrieve", "port": destination.port}
+
+        # One path with a health check and three requests
+        assert len(pool.paths) == 1
+        path = pool.paths[0]
+        assert all(hop.node.port != destination.port for hop in path.hops[:-1])
+        assert destination.requests.count("retrieve") == 3
+        assert sum(server.requests.count("info") for server in servers) == 1
+
+        # Every hop and the destination see their own ephemeral key
+        seen = [key for server in servers for key in server.ephemeral_keys]
+        assert len(seen) == len(set(seen)) == 4
+    finally:
+        await swarm.close()
+        await session.close()
+        for server in servers:
+            await server.runner.cleanup()
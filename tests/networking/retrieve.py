@@ -0,0 +1,57 @@
+"""Unit test for /pysession/networking/retrieve.py"""
+
+import asyncio
+import base64
+
+import pytest
+
+from pysession.networking.retrieve import MessagePoller
+
+
+class FakeSwarm:
+    """Swarm that serves a fixed message store per public key"""
+
+    def __init__(self, store):
+        self.store = store
+        self.requests = []
+
+    async def get_swarm_node_url(self, public_key):
+        return "https://127.0.0.1:1/storage_rpc/v1"
+
+    async def ask_public_key(self, url, method, public_key, params={}):
+        self.requests.append((public_key, params["lastHash"]))
+        messages = self.store.get(public_key, [])
+        hashes = [message["hash"] for message in messages]
+        start = hashes.index(params["lastHash"]) + 1 if params["lastHash"] else 0
+        return {"messages": messages[start:]}
+
+
+def message(n):
+    return {"hash": f"h{n}", "expiration": n, "data": base64.b64encode(b"%d" % n)}
+
+
+@pytest.mark.asyncio
+async def test_poller_cursor():
+    """Every message should be yielded once and idle accounts should back off"""
+    store = {"05aa": [message(1), message(2)], "05bb": []}
+    swarm = FakeSwarm(store)
+
+    poller = MessagePoller(swarm, concurrency=2, min_interval=0.01, max_interval=0.04)
+    poller.add("05aa")
+    poller.add("05bb")
+
+    async with poller:
+        received = [await poller.get(1), await poller.get(1)]
+        store["05aa"].append(message(3))
+        received.append(await poller.get(1))
+
+    assert [m.data for m in received] == [b"1", b"2", b"3"]
+    assert poller.cursors["05aa"] == "h3"
+    assert poller.intervals["05bb"] > poller.min_interval
+    assert ("05aa", "h2") in swarm.requests
+
+    # The poller should be stopped
+    await asyncio.sleep(0.05)
+    count = len(swarm.requests)
+    await asyncio.sleep(0.05)
+    assert len(swarm.requests) == count
@@ -0,0 +1,26 @@
+"""Unit test for /pysession/networking/selection.py"""
+
+from pysession.networking.selection import PowerOfTwoSelector
+
+
+def test_prefers_fast_nodes():
+    """The slow node should lose every comparison"""
+    selector = PowerOfTwoSelector()
+    selector.report_success("fast", 0.05)
+    selector.report_success("slow", 5.0)
+
+    assert all(selector.choose(["fast", "slow"]) == "fast" for _ in range(20))
+
+
+def test_circuit_breaker():
+    """Nodes that keep failing should be skipped until they cooled down"""
+    selector = PowerOfTwoSelector(max_failures=2, cooldown=60)
+    selector.report_failure("broken")
+    assert selector.available("broken")
+
+    selector.report_failure("broken")
+    assert not selector.available("broken")
+    assert all(selector.choose(["broken", "ok"]) == "ok" for _ in range(20))
+
+    # Fall back to all nodes when every node is cooling down
+    assert selector.choose(["broken"]) == "broken"
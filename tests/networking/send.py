@@ -0,0 +1,80 @@
+"""Unit test for /pysession/networking/send.py"""
+
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from pysession.networking.cache import SwarmCache
+from pysession.networking.selection import NodeSelector
+from pysession.networking.send import MessageSender
+
+
+class FakeSwarm:
+    """Swarm that maps every public key to a single local node"""
+
+    def __init__(self, url):
+        self.url = url
+        self.selector = NodeSelector()
+        self.swarm_map = SwarmCache()
+
+    async def get_swarm_node_url(self, public_key):
+        return self.url
+
+
+@pytest.mark.asyncio
+async def test_batched_store():
+    """Messages should be stored in batches without exceeding the queue depth"""
+    batches = []
+
+    async def handler(request):
+        body = await request.json()
+        batches.append(len(body))
+        await asyncio.sleep(0.01)
+        return web.json_response(
+            [{"id": call["id"], "hash": call["params"]["data"]} for call in body]
+        )
+
+    app = web.Application()
+    app.router.add_post("/", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{runner.addresses[0][1]}/"
+
+    try:
+        sender = MessageSender(FakeSwarm(url), max_pending=8, batch_size=4)
+        async with sender:
+            futures = [await sender.send("05aa", b"%d" % n) for n in range(20)]
+        results = await asyncio.gather(*futures)
+    finally:
+        await runner.cleanup()
+
+    assert len(results) == 20
+    assert sum(batches) == 20
+    assert max(batches) <= 4
+    assert len(batches) < 20
+
+
+@pytest.mark.asyncio
+async def test_failed_store():
+    """Messages to an unreachable node should fail instead of blocking the queue"""
+    app = web.Application()
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{runner.addresses[0][1]}/"
+    # Nothing listens on the port anymore
+    await runner.cleanup()
+
+    swarm = FakeSwarm(url)
+    async with MessageSender(swarm, max_pending=2, batch_size=2) as sender:
+        futures = [
+            await asyncio.wait_for(sender.send("05aa", b"%d" % n), 5) for n in range(6)
+        ]
+    results = await asyncio.gather(*futures, return_exceptions=True)
+
+    assert all(isinstance(result, Exception) for result in results)
+    assert swarm.selector.stats[url].error_rate > 0
@@ -0,0 +1,61 @@
+"""Unit test for /pysession/networking/shard.py"""
+
+import asyncio
+import multiprocessing
+import os
+
+from pysession.networking.shard import HashRing, ShardedRunner
+
+KEYS = ["05%064x" % n for n in range(200)]
+
+
+def test_hash_ring():
+    """Removing a member should only move the keys of that member"""
+    ring = HashRing(range(4))
+    before = {key: ring.owner(key) for key in KEYS}
+    assert set(before.values()) == {0, 1, 2, 3}
+
+    ring.remove(2)
+    after = {key: ring.owner(key) for key in KEYS}
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert moved and all(before[key] == 2 for key in moved)
+    assert 2 not in after.values()
+
+
+class Reporter:
+    """Reports the keys of every shard and stops it when its stop file exists"""
+
+    def __init__(self, report, stop_path):
+        self.report = report
+        self.stop_path = stop_path
+
+    async def __call__(self, shard):
+        def changed(added, removed):
+            self.report.put((shard.worker_id, sorted(shard.public_keys)))
+
+        shard.on_change(changed)
+        changed(set(), set())
+        while not os.path.exists(f"{self.stop_path}.{shard.worker_id}"):
+            await asyncio.sleep(0.01)
+
+
+def test_rebalance(tmp_path):
+    """Keys of an exited worker should be handed to the remaining workers"""
+    context = multiprocessing.get_context("spawn")
+    report = context.Queue()
+    stop_path = str(tmp_path / "stop")
+
+    with ShardedRunner(
+        Reporter(report, stop_path), KEYS, workers=2, context=context
+    ) as runner:
+        started = dict(report.get(timeout=30) for _ in range(2))
+        assert sorted(started[0] + started[1]) == sorted(KEYS)
+
+        # Worker 0 finishes, worker 1 takes over its keys
+        open(f"{stop_path}.0", "w").close()
+        while 0 in runner.processes:
+            runner.supervise(10)
+        worker_id, keys = report.get(timeout=10)
+        assert worker_id == 1
+        assert keys == sorted(KEYS)
+        assert runner.exit_codes[0] == [0]
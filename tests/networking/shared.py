@@ -0,0 +1,52 @@
+"""Unit test for /pysession/networking/shared.py"""
+
+import multiprocessing
+
+import pytest
+
+from pysession.networking.shared import SharedStore, SharedStoreError
+
+KEY = "05" + "ab" * 32
+
+
+def write_swarm(path, lock):
+    store = SharedStore.attach(path, lock)
+    store.set_swarm(KEY, 7)
+    store.publish_nodes({"service_node_states": [{"public_ip": "10.0.0.1"}]})
+    store.close()
+
+
+def test_shared_between_processes(tmp_path):
+    """Swarms and nodes written by one process should be read by another"""
+    context = multiprocessing.get_context("spawn")
+    lock = context.Lock()
+    store = SharedStore.create(str(tmp_path / "store"), lock, slots=8)
+    assert store.get_swarm(KEY) is None
+    assert store.read_nodes() is None
+
+    process = context.Process(target=write_swarm, args=(store.path, lock))
+    process.start()
+    process.join()
+
+    assert store.get_swarm(KEY) == 7
+    assert store.get_swarm(KEY, max_age=-1) is None
+    assert store.nodes_version == 1
+    nodes = store.read_nodes(max_age=60)
+    assert nodes["service_node_states"] == [{"public_ip": "10.0.0.1"}]
+    # Decoded once per version
+    assert store.read_nodes() is nodes
+    store.close()
+
+
+def test_full_table(tmp_path):
+    """A full table should replace old entries instead of growing"""
+    store = SharedStore.create(str(tmp_path / "store"), multiprocessing.Lock(), 4)
+    keys = ["05%064x" % n for n in range(10)]
+    for n, key in enumerate(keys):
+        store.set_swarm(key, n)
+    assert store.get_swarm(keys[-1]) == 9
+    assert sum(store.get_swarm(key) is not None for key in keys) == 4
+
+    with pytest.raises(SharedStoreError):
+        store.set_swarm("05ab", 1)
+    store.close()
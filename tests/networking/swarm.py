@@ -0,0 +1,284 @@
+"""Unit test for /pysession/networking/swarm.py"""
+
+import asyncio
+import multiprocessing
+
+import pytest
+from aiohttp import web
+
+from pysession.networking.node import Node
+from pysession.networking.shared import SharedStore
+from pysession.networking.swarm import Swarm
+from pysession.networking.util import close_client
+
+
+@pytest.fixture
+def public_key() -> str:
+    return "05" + "ab" * 32
+
+
+@pytest.mark.asyncio
+async def test_single_flight_lookup(public_key):
+    """Concurrent lookups for one public key should share a single request"""
+    swarm = Swarm()
+    calls = []
+
+    async def fetch_swarm(key):
+        calls.append(key)
+        await asyncio.sleep(0.05)
+        return (Node("127.0.0.1", 1),)
+
+    swarm.fetch_swarm = fetch_swarm
+    urls = await asyncio.gather(
+        *(swarm.get_swarm_node_url(public_key) for _ in range(10))
+    )
+
+    assert calls == [public_key]
+    assert set(urls) == {"https://127.0.0.1:1/storage_rpc/v1"}
+    assert not swarm.swarm_lookups
+    await swarm.close()
+
+
+@pytest.mark.asyncio
+async def test_parallel_lookups():
+    """Lookups for different public keys should not wait on each other"""
+    swarm = Swarm(max_swarm_lookups=2)
+    running = 0
+    peak = 0
+
+    async def fetch_swarm(key):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.05)
+        running -= 1
+        return (Node("127.0.0.1", 1),)
+
+    swarm.fetch_swarm = fetch_swarm
+    keys = ["05" + f"{n:02x}" * 32 for n in range(5)]
+    await asyncio.gather(*(swarm.lookup_swarm(key) for key in keys))
+
+    # Capped by max_swarm_lookups
+    assert peak == 2
+    assert len(swarm.swarm_map) == 5
+    await swarm.close()
+
+
+@pytest.mark.asyncio
+async def test_node_registry_incremental():
+    """Only changes to the node list should create a new snapshot"""
+    swarm = Swarm()
+    nodes = [
+        {"public_ip": "10.0.0.1", "storage_port": 1, "swarm_id": 7},
+        {"public_ip": "10.0.0.2", "storage_port": 2, "swarm_id": 7},
+        {"public_ip": "0.0.0.0", "storage_port": 3, "swarm_id": 7},
+    ]
+    polls = []
+
+    async def fetch_service_nodes(block_hash=None):
+        polls.append(block_hash)
+        if block_hash == "b2":
+            return {"unchanged": True, "block_hash": "b2"}
+        return {"service_node_states": list(nodes), "block_hash": f"b{len(polls)}"}
+
+    swarm.node_registry.fetch = fetch_service_nodes
+    urls = await swarm.storage_servers_from_service_nodes()
+    assert sorted(urls) == [
+        "https://10.0.0.1:1/storage_rpc/v1",
+        "https://10.0.0.2:2/storage_rpc/v1",
+    ]
+    first = swarm.node_registry.snapshot
+    assert len(first.swarm(7)) == 2
+
+    # Remove a node
+    nodes.pop(0)
+    second = await swarm.node_registry.refresh()
+    assert second.version == first.version + 1
+    assert second.urls == ("https://10.0.0.2:2/storage_rpc/v1",)
+    assert second.nodes[("10.0.0.2", 2)] is first.nodes[("10.0.0.2", 2)]
+
+    # Nothing changed on chain
+    third = await swarm.node_registry.refresh()
+    assert third.version == second.version
+    assert polls == [None, "b1", "b2"]
+
+    # Old snapshots are not touched
+    assert len(first.urls) == 2
+    await swarm.close()
+
+
+@pytest.fixture
+def primed_swarm(public_key):
+    """Swarm with three known nodes for the public key"""
+    swarm = Swarm()
+    swarm.swarm_map.set(public_key, tuple(Node("127.0.0.1", n) for n in range(3)))
+    return swarm
+
+
+@pytest.mark.asyncio
+async def test_hedged_request(primed_swarm, public_key):
+    """A slow node should be overtaken by the hedged request"""
+    cancelled = []
+
+    async def ask_public_key(url, method, key, params={}):
+        if not cancelled:
+            cancelled.append(url)
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append("cancelled")
+                raise
+        return {"url": url}
+
+    primed_swarm.ask_public_key = ask_public_key
+    result = await primed_swarm.ask_swarm_hedged(
+        public_key, "retrieve", hedge_after=0.01
+    )
+    await asyncio.sleep(0)
+
+    assert result["url"] != cancelled[0]
+    assert cancelled[-1] == "cancelled"
+    await primed_swarm.close()
+
+
+@pytest.mark.asyncio
+async def test_quorum_request(primed_swarm, public_key):
+    """The answer given by most nodes should win"""
+
+    async def ask_public_key(url, method, key, params={}):
+        if url.startswith("https://127.0.0.1:0/"):
+            return {"messages": ["stale"]}
+        return {"messages": ["fresh"]}
+
+    primed_swarm.ask_public_key = ask_public_key
+    result = await primed_swarm.ask_swarm_quorum(public_key, "retrieve")
+    assert result == {"messages": ["fresh"]}
+
+    merged = await primed_swarm.ask_swarm_quorum(
+        public_key,
+        "retrieve",
+        quorum=3,
+        merge=lambda answers: sorted(m for a in answers for m in a["messages"]),
+    )
+    assert merged == ["fresh", "fresh", "stale"]
+    await primed_swarm.close()
+
+
+@pytest.mark.asyncio
+async def test_raced_seeds():
+    """The first seed with a valid answer should be used"""
+
+    async def slow(request):
+        await asyncio.sleep(1)
+        return web.json_response({})
+
+    async def broken(request):
+        return web.json_response({"result": {"service_node_states": []}})
+
+    async def good(request):
+        states = [{"public_ip": "10.0.0.1", "storage_port": 1}]
+        return web.json_response({"result": {"service_node_states": states}})
+
+    runners = []
+    seeds = []
+    for handler in (slow, broken, good):
+        app = web.Application()
+        app.router.add_post("/json_rpc", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        runners.append(runner)
+        seeds.append({"url": f"http://127.0.0.1:{runner.addresses[0][1]}/json_rpc"})
+
+    swarm = Swarm()
+    swarm.seed_node_list = seeds
+    try:
+        urls = await asyncio.wait_for(swarm.storage_servers_from_seed(), 0.5)
+        assert urls == ["https://10.0.0.1:1/storage_rpc/v1"]
+    finally:
+        await swarm.close()
+        await close_client()
+        for runner in runners:
+            await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_snapshot(tmp_path, public_key):
+    """Nodes and swarms should be served from the snapshot of a previous run"""
+    path = str(tmp_path / "snapshot.json")
+    swarm = Swarm(snapshot_path=path)
+    swarm.storage_server_seed_cache = ["https://10.0.0.1:1/storage_rpc/v1"]
+    swarm.node_registry.apply(
+        {
+            "service_node_states": [{"public_ip": "10.0.0.2", "storage_port": 2}],
+            "block_hash": "b1",
+        }
+    )
+    swarm.swarm_map.set(public_key, (Node("10.0.0.3", 3),))
+    await swarm.close()
+
+    restored = Swarm(snapshot_path=path)
+    assert restored.storage_server_seed_cache == swarm.storage_server_seed_cache
+    assert restored.node_registry.stale
+    assert restored.node_registry.snapshot.urls == (
+        "https://10.0.0.2:2/storage_rpc/v1",
+    )
+    assert await restored.get_swarm_node_url(public_key) == (
+        "https://10.0.0.3:3/storage_rpc/v1"
+    )
+
+    # Too old snapshots are ignored
+    assert not Swarm().load_snapshot(path, max_age=-1)
+
+
+@pytest.mark.asyncio
+async def test_shared_store(tmp_path, public_key):
+    """Swarms and nodes found by another process should not be fetched again"""
+    store = SharedStore.create(str(tmp_path / "store"), multiprocessing.Lock(), 8)
+    store.publish_nodes(
+        {
+            "service_node_states": [
+                {"public_ip": "10.0.0.1", "storage_port": 1, "swarm_id": 5},
+                {"public_ip": "10.0.0.2", "storage_port": 2, "swarm_id": 6},
+            ],
+            "block_hash": "b1",
+        }
+    )
+    store.set_swarm(public_key, 5)
+
+    swarm = Swarm()
+    swarm.shared = store
+
+    async def no_network(*args, **kwargs):
+        raise AssertionError("The shared store should have been used")
+
+    swarm.request_node = no_network
+    try:
+        assert await swarm.lookup_swarm(public_key) == (Node("10.0.0.1", 1),)
+        assert await swarm.fetch_service_nodes("b1") == {
+            "unchanged": True,
+            "block_hash": "b1",
+        }
+    finally:
+        await swarm.close()
+        store.close()
+
+
+@pytest.mark.asyncio
+async def test_random_service_node():
+    """Nodes are picked from the node list, not from the cached swarms"""
+    swarm = Swarm()
+    for n in range(100):
+        swarm.swarm_map.set("05%064x" % n, (Node("10.0.1.1", n + 1),))
+
+    seed = "https://10.0.0.9:9/storage_rpc/v1"
+
+    async def storage_servers_from_seed():
+        return [seed]
+
+    swarm.storage_servers_from_seed = storage_servers_from_seed
+    assert await swarm.random_service_node(True) == seed
+
+    swarm.node_registry.restore([Node("10.0.0.1", 1)])
+    assert await swarm.random_service_node(True) == "https://10.0.0.1:1/storage_rpc/v1"
+    await swarm.close()
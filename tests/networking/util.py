@@ -1,8 +1,28 @@
 """Unit test for /pysession/networking/util.py"""
+
+import asyncio
+from contextlib import asynccontextmanager
+
 import pytest
+from aiohttp import web
 from aiohttp.client_exceptions import ContentTypeError
 
-from pysession.networking.util import request_json, request_stream, request_text
+from pysession.networking.util import (
+    Client,
+    HTTPStatusError,
+    JsonRpcBatch,
+    JsonRpcError,
+    RequestConnectionError,
+    RequestTimeout,
+    _batch_unsupported,
+    deadline,
+    request_json,
+    request_jsonrpc,
+    request_jsonrpc_batch,
+    request_stream,
+    request_text,
+    retry,
+)
 
 
 @pytest.fixture
@@ -10,6 +30,22 @@ def httpbin_url():
     return "https://httpbin.org"
 
 
+@asynccontextmanager
+async def local_server(handler):
+    """Serve a single handler on a random localhost port"""
+    app = web.Application()
+    app.router.add_post("/{tail:.*}", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        await runner.cleanup()
+
+
 @pytest.mark.asyncio
 async def test_valid_json(httpbin_url):
     result = await request_json(httpbin_url + "/anything")
@@ -33,8 +69,8 @@ async def test_error_request(httpbin_url):
     try:
         await request_text(httpbin_url + "/status/500")
         assert False
-    except AssertionError:
-        pass
+    except HTTPStatusError as ex:
+        assert ex.status == 500
 
 
 @pytest.mark.asyncio
@@ -62,3 +98,174 @@ async def test_valid_buffer(httpbin_url):
 
     buffer = await request_stream(httpbin_url + "/anything", handle_stream)
     assert httpbin_url + "/anything" in buffer
+
+
+@pytest.mark.asyncio
+async def test_client_reuses_connections():
+    """Multiple requests through one client should share a single connection"""
+    peers = set()
+
+    async def handler(request):
+        peers.add(request.transport.get_extra_info("peername"))
+        return web.json_response({"ok": True})
+
+    async with local_server(handler) as url:
+        async with Client() as client:
+            for _ in range(5):
+                assert await request_json(url, client=client) == {"ok": True}
+            assert len(peers) == 1
+        assert client.closed
+
+
+def test_client_new_loop():
+    """A session of a closed event loop should be closed when it is replaced"""
+    client = Client()
+
+    async def session():
+        return client.session()
+
+    old = asyncio.run(session())
+
+    async def replace():
+        new = client.session()
+        await asyncio.sleep(0)
+        await client.close()
+        return new
+
+    assert asyncio.run(replace()) is not old
+    assert old.closed
+
+
+@pytest.mark.asyncio
+async def test_jsonrpc_body():
+    """Test if the jsonrpc request is formatted correctly"""
+
+    async def handler(request):
+        body = await request.json()
+        return web.json_response({"result": body})
+
+    async with local_server(handler) as url:
+        async with Client() as client:
+            result = await request_jsonrpc(url, "ping", {"a": 1}, client=client)
+
+    assert result["result"]["method"] == "ping"
+    assert result["result"]["params"] == {"a": 1}
+
+
+@pytest.mark.asyncio
+async def test_jsonrpc_batch():
+    """Batched calls should be sent in one request and matched by id"""
+    requests = []
+
+    async def handler(request):
+        body = await request.json()
+        requests.append(body)
+        # Answer in reverse order to test demultiplexing
+        return web.json_response(
+            [{"id": call["id"], "result": call["params"]} for call in body[::-1]]
+        )
+
+    async with local_server(handler) as url:
+        async with Client() as client:
+            calls = [("ping", {"n": n}) for n in range(4)]
+            results = await request_jsonrpc_batch(url, calls, client=client)
+
+    assert len(requests) == 1
+    assert len({call["id"] for call in requests[0]}) == 4
+    assert [result["result"]["n"] for result in results] == [0, 1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_jsonrpc_batch_fallback():
+    """Nodes that reject batches should receive individual requests"""
+
+    async def handler(request):
+        body = await request.json()
+        if isinstance(body, list):
+            return web.json_response({"error": "batches are not supported"})
+        return web.json_response({"id": body["id"], "result": body["params"]})
+
+    async with local_server(handler) as url:
+        async with Client() as client:
+            calls = [("ping", {"n": n}) for n in range(3)]
+            results = await request_jsonrpc_batch(url, calls, client=client)
+
+    assert [result["result"]["n"] for result in results] == [0, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_jsonrpc_batch_errors():
+    """Failed batches should resolve every future and keep batching enabled"""
+
+    async def handler(request):
+        return web.Response(status=503)
+
+    async with local_server(handler) as url:
+        async with Client() as client:
+            batch = JsonRpcBatch(url, client=client)
+            futures = [batch.add("ping", {"n": n}) for n in range(2)]
+            await batch.send()
+            for future in futures:
+                with pytest.raises(HTTPStatusError):
+                    future.result()
+    assert url not in _batch_unsupported
+
+    # Nothing listens on the port of the stopped server
+    async with Client() as client:
+        batch = JsonRpcBatch(url, client=client)
+        futures = [batch.add("ping", {"n": n}) for n in range(2)]
+        await batch.send()
+        for future in futures:
+            with pytest.raises(RequestConnectionError):
+                future.result()
+
+
+@pytest.mark.asyncio
+async def test_structured_errors():
+    """Status codes, jsonrpc errors and timeouts should raise their own errors"""
+
+    async def handler(request):
+        if request.path == "/status":
+            return web.Response(status=503)
+        if request.path == "/slow":
+            await asyncio.sleep(1)
+        return web.json_response({"error": {"code": -32601, "message": "Unknown"}})
+
+    async with local_server(handler) as url:
+        async with Client() as client:
+            with pytest.raises(HTTPStatusError) as status:
+                await request_text(url + "/status", client=client)
+            assert status.value.status == 503
+
+            with pytest.raises(JsonRpcError) as error:
+                await request_jsonrpc(url + "/rpc", "nope", {}, client=client)
+            assert error.value.code == -32601
+
+            # The deadline applies to nested calls
+            with deadline(0.1):
+                with pytest.raises(RequestTimeout):
+                    await request_jsonrpc(url + "/slow", "ping", {}, client=client)
+
+
+@pytest.mark.asyncio
+async def test_retry():
+    """Transient errors are retried, others are raised immediately"""
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise HTTPStatusError("http://node", 503)
+        return "ok"
+
+    assert await retry(flaky, attempts=3, base_delay=0.01) == "ok"
+    assert len(calls) == 3
+
+    async def missing():
+        calls.append(1)
+        raise HTTPStatusError("http://node", 404)
+
+    calls.clear()
+    with pytest.raises(HTTPStatusError):
+        await retry(missing, base_delay=0.01)
+    assert len(calls) == 1